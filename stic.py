@@ -1,7 +1,7 @@
 #! /usr/bin/env python
 """ stic.py: Check the port correspondence of a stack of GDSII chips.
 
-    usage: stic.py [-t] sticXmlFile [outputFile]
+    usage: stic.py [-t] [-j jobs] sticXmlFile [outputFile]
 
     Inputs:
       sticXmlFile: XML file containing chip placement definitions. stic.xsd is the XML schema.
@@ -40,17 +40,32 @@ import getopt
 import gzip
 import re
 import os
+import io
+import math
+import mmap
+import shutil
+import subprocess
 import copy
-import xml.etree.ElementTree as ET
+try:
+    from lxml import etree as ET  # faster find/findall when installed
+except ImportError:
+    import xml.etree.ElementTree as ET
 from gdsii.library import Library
 from gdsii.elements import *
 from gdsii.record import *
 import numpy as np
 from operator import attrgetter
 from pprint import pprint
-from ast import literal_eval
 import json
+import pickle
+try:
+    import orjson  # faster port file read/write when installed
+except ImportError:
+    orjson = None
 import errno
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 
 def DisplayLicense():
     """Display GPLv3 reference."""
@@ -61,63 +76,112 @@ def DisplayLicense():
     print("and you are welcome to redistribute it under certain conditions.")
     print("See http://www.gnu.org/licenses/ for details.\n")
 
+def OpenUnzipPipe(theFileName, theMode):
+    """Return a pipe reading theFileName through pigz or gzip, or None if neither is installed.
+
+    Decompression runs in a separate process in parallel with parsing.
+    """
+    for unzip_it in ["pigz", "gzip"]:
+        myUnzip = shutil.which(unzip_it)
+        if myUnzip: break
+    else:
+        return None
+    with open(theFileName, "rb") as myZipFile:  # open errors are reported as for other files
+        myProcess = subprocess.Popen([myUnzip, "-dc"], stdin=myZipFile, stdout=subprocess.PIPE)
+    myFile = myProcess.stdout if "b" in theMode else io.TextIOWrapper(myProcess.stdout)
+    myFile.process = myProcess  # keep the decompression process with the file
+    myFile.fileName = theFileName  # for decompression errors
+    return myFile
+
 def OpenFile(theFileName, theMode="rt"):
     """Open a file (possibly compressed gz) and return file"""
     try:
         if theFileName.endswith(".gz"):
-            myFile = gzip.open(theFileName, mode=theMode)
+            myFile = OpenUnzipPipe(theFileName, theMode) if "r" in theMode else None
+            if myFile is None:
+                myFile = gzip.open(theFileName, mode=theMode)
         else:
-            myFile = open(theFileName, mode=theMode)
+            myFile = open(theFileName, mode=theMode, buffering=1 << 20)  # 1MB reads
     except IOError as myErrorDetail:
         print("ERROR: Could not open " + theFileName + " " + str(myErrorDetail.args))
         raise IOError
     return myFile
 
+def CloseFile(theFile, theStoppedEarly=False):
+    """Close a file from OpenFile and wait for its decompression process.
+
+    theStoppedEarly: True if reading stopped before the end of the file.
+    Otherwise the rest of the file is read and a failed decompression, such as a truncated
+    .gz file, raises IOError.
+    """
+    if not hasattr(theFile, 'process'):
+        theFile.close()
+        return
+    if theStoppedEarly:
+        theFile.process.terminate()
+    else:
+        while theFile.read(1 << 20):  # trailing data, e.g. GDS padding after ENDLIB
+            pass
+    theFile.close()
+    myStatus = theFile.process.wait()
+    if myStatus != 0 and not theStoppedEarly:
+        print("ERROR: Could not decompress " + theFile.fileName
+              + ", exit status " + str(myStatus))
+        raise IOError
+
+def OpenGdsFile(theFileName):
+    """Open a GDS file for reading, memory mapped unless compressed or empty."""
+    myFile = OpenFile(theFileName, "rb")
+    if theFileName.endswith(".gz") or os.path.getsize(theFileName) == 0:
+        return myFile
+    myMap = mmap.mmap(myFile.fileno(), 0, access=mmap.ACCESS_READ)  # parse from the page cache
+    myFile.close()
+    return myMap
+
+MIRROR_BIT = 0x8000  # strans reflection bit
+ORIENTATIONS = {  # {(mirrored, angle): orientation, ...}
+    (False, 0): "R0", (False, 90): "R90", (False, 180): "R180", (False, 270): "R270",
+    (True, 0): "MX", (True, 90): "MXR90", (True, 180): "MY", (True, 270): "MYR90"}
+
 def GetOrientation(theElement):
     """Return a combined reflection/rotation orientation.
 
     R0, R90, R180, R270, MX, MXR90, MY, MYR90
     Doesn't handle magnification.
     """
-    if theElement.strans and (theElement.strans & int('1000000000000000', 2)):
-        if not theElement.angle: return "MX"
-        if theElement.angle == 90: return "MXR90"
-        if theElement.angle == 180: return "MY"
-        if theElement.angle == 270: return "MYR90" 
-    else:
-        if not theElement.angle: return "R0"
-        if theElement.angle == 90: return "R90"
-        if theElement.angle == 180: return "R180"
-        if theElement.angle == 270: return "R270"
-    print("ERROR: Invalid transform " + "{0:016b}".format(theElement.strans) + " in element")  
-    raise ValueError
+    myMirrored = bool(theElement.strans and theElement.strans & MIRROR_BIT)
+    myKey = (myMirrored, theElement.angle or 0)
+    myOrientation = ORIENTATIONS.get(myKey)
+    if myOrientation is None:
+        print("ERROR: Invalid transform " + "{0:016b}".format(theElement.strans or 0) + " in element")  
+        raise ValueError
+    return myOrientation
+
+ROTATIONS = {  # {orientation: rotation matrix, ...}
+    "R0": np.array([(1,0,0), (0,1,0), (0,0,1)], dtype=np.int64),
+    "R90": np.array([(0,1,0), (-1,0,0), (0,0,1)], dtype=np.int64),
+    "R180": np.array([(-1,0,0), (0,-1,0), (0,0,1)], dtype=np.int64),
+    "R270": np.array([(0,-1,0), (1,0,0), (0,0,1)], dtype=np.int64),
+    "MX": np.array([(1,0,0), (0,-1,0), (0,0,1)], dtype=np.int64),
+    "MXR90": np.array([(0,1,0), (1,0,0), (0,0,1)], dtype=np.int64),
+    "MY": np.array([(-1,0,0), (0,1,0), (0,0,1)], dtype=np.int64),
+    "MYR90": np.array([(0,-1,0), (-1,0,0), (0,0,1)], dtype=np.int64)}
+for rotation_it in ROTATIONS.values():
+    rotation_it.setflags(write=False)  # shared by all callers, copy before changing
 
 def GetTransform(theOrientation, theTranslation):
     """Return a transformation matrix for given orientation, translation.
 
     return: [(z0,y0,z0), (x1,y1,z1), (x2,y2,z2)] 
     """
-    if theOrientation == "R0":
-        myRotation = np.array([(1,0,0), (0,1,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "R90":
-        myRotation = np.array([(0,1,0), (-1,0,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "R180":
-        myRotation = np.array([(-1,0,0), (0,-1,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "R270":
-        myRotation = np.array([(0,-1,0), (1,0,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "MX":
-        myRotation = np.array([(1,0,0), (0,-1,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "MXR90":
-        myRotation = np.array([(0,1,0), (1,0,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "MY":
-        myRotation = np.array([(-1,0,0), (0,1,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "MYR90":
-        myRotation = np.array([(0,-1,0), (-1,0,0), (0,0,1)], dtype=np.int64)
-    myTranslation = np.array([(1,0,0), (0,1,0), (theTranslation[0][0],theTranslation[0][1],1)],
-                             dtype=np.int64)
-#    myScale = np.array([(float(theScale),0.,0.),(0.,float(theScale),0.),(0.,0.,1.)], dtype=np.float64)
-#    myTransform = np.dot(np.dot(myScale, myRotation), myTranslation)
-    myTransform = np.dot(myRotation, myTranslation)
+    if theOrientation not in ROTATIONS:
+        print("ERROR: Invalid orientation " + str(theOrientation))
+        raise ValueError
+    if theTranslation[0][0] == 0 and theTranslation[0][1] == 0:
+        return ROTATIONS[theOrientation]  # read only
+    # rotation x translation only replaces the last row of the rotation
+    myTransform = ROTATIONS[theOrientation].copy()
+    myTransform[2, :2] = theTranslation[0]
     return myTransform
 
 def FlipPort(theWinding, theOrientation):
@@ -129,24 +193,20 @@ def FlipPort(theWinding, theOrientation):
     return myNewWinding
 
 def Transform(thePointList, theTransform):
-    """Returns a list of transformed points.
+    """Returns an array of transformed points.
 
-    return: [(x,y), ...]
+    return: array of (x,y)
     """
-    myResult = []  # [(x,y), ...]
-    for point_it in thePointList:
-        myPoint = [point_it[0], point_it[1], 1]
-        myProduct = np.dot(myPoint, theTransform)
-        myResult.append((myProduct[0], myProduct[1]))
-    return myResult
+    myPoints = np.asarray(thePointList, dtype=np.int64).reshape(-1, 2)
+    return np.dot(myPoints, theTransform[:2, :2]) + theTransform[2, :2]  # all points at once
 
-def NormalizeBox(theBox):
-    """Normalize (LowerLeft, UpperRight) box coordinates.
+def NormalizeBoxes(theBoxes):
+    """Normalize an array of (LowerLeft, UpperRight) box coordinates.
 
-    return: [(left, bottom), (right, top)]
+    return: array of [(left, bottom), (right, top)]
     """
-    return [(min(theBox[0][0], theBox[1][0]), min(theBox[0][1], theBox[1][1])),
-            (max(theBox[0][0], theBox[1][0]), max(theBox[0][1], theBox[1][1]))]
+    return np.stack((np.minimum(theBoxes[:, 0], theBoxes[:, 1]),
+                     np.maximum(theBoxes[:, 0], theBoxes[:, 1])), axis=1)
 
 def GetLayerType(thePort):
     """Return "layerNumber-dataType". """
@@ -162,39 +222,50 @@ def GetTextType(thePort):
 
 def PrintParameters(theStackedChip):
     """Print XML parameters."""
-    print("Top CDL " + theStackedChip.find('topCdlFile').text
-          + ", Top SUBCKT " + theStackedChip.find('topCell').text)
-    print("User units " + theStackedChip.find('userUnits').text)
-    print("Tolerance: " + theStackedChip.find('tolerance').text)
+    myLines = []
+    myLines.append("Top CDL " + theStackedChip.find('topCdlFile').text
+                   + ", Top SUBCKT " + theStackedChip.find('topCell').text)
+    myLines.append("User units " + theStackedChip.find('userUnits').text)
+    myLines.append("Tolerance: " + theStackedChip.find('tolerance').text)
     chipCount = 0
     for chip_it in theStackedChip.findall('chip'):
         chipCount += 1
-        print("\nChip " + str(chipCount) + ":")
-        print(" CDL instance: " + chip_it.find('instanceName').text)
+        myLines.append("\nChip " + str(chipCount) + ":")
+        myLines.append(" CDL instance: " + chip_it.find('instanceName').text)
         if chip_it.find('subcktName') is not None:
             mySubcktName = chip_it.find('subcktName').text
         else:
             mySubcktName = "look up in CDL"
-        print(" CDL file: " + chip_it.find('cdlFileName').text
-              + ", top block: " + mySubcktName)
-        print(" GDS file: " + chip_it.find('gdsFileName').text
-              + ", top block: " + chip_it.find('layoutName').text)
-        print(" Orientation: " + chip_it.find('orientation').text
-              + "; Offset: (" + chip_it.find('offset').find('x').text
-              + ", " + chip_it.find('offset').find('y').text + ")"
-              + "; Shrink: " + chip_it.find('shrink').text)
+        myLines.append(" CDL file: " + chip_it.find('cdlFileName').text
+                       + ", top block: " + mySubcktName)
+        myLines.append(" GDS file: " + chip_it.find('gdsFileName').text
+                       + ", top block: " + chip_it.find('layoutName').text)
+        myOffset = chip_it.find('offset')
+        myLines.append(" Orientation: " + chip_it.find('orientation').text
+                       + "; Offset: (" + myOffset.find('x').text
+                       + ", " + myOffset.find('y').text + ")"
+                       + "; Shrink: " + chip_it.find('shrink').text)
         if chip_it.find('portFile') is not None:
-            print(" Text file name: " + chip_it.find('portFile').text)
+            myLines.append(" Text file name: " + chip_it.find('portFile').text)
         for port_it in chip_it.findall('port'):
-            myPort = " Port: " + port_it.find('type').text + " " + GetLayerType(port_it)
-            myPort += "; Text: " + GetTextType(port_it)
-            myPortPrefix = "; ("
-            for cell_it in port_it.findall('portCell'):
-                myPort += myPortPrefix + cell_it.text
-                myPortPrefix = ", "
-            myPort += ")"
-            print(myPort)
-            
+            myCells = [cell_it.text for cell_it in port_it.findall('portCell')]
+            if myCells:
+                myCellList = "; (" + ", ".join(myCells) + ")"
+            else:
+                myCellList = ")"
+            myLines.append(" Port: " + port_it.find('type').text + " " + GetLayerType(port_it)
+                           + "; Text: " + GetTextType(port_it) + myCellList)
+    sys.stdout.write("\n".join(myLines) + "\n")
+
+def GetSubcktName(theLine):
+    """Return the subckt name if theLine is a .SUBCKT statement, else None."""
+    if theLine[:7].lower() != ".subckt":  # only split candidate lines
+        return None
+    myWordList = theLine.split(None, 2)
+    if len(myWordList) > 1 and myWordList[0].lower() == ".subckt":
+        return myWordList[1]
+    return None
+
 def ReadTopCdlFile(theStackedChip):
     """Read a CDL netlist and return a list of top instances with nets.
 
@@ -202,116 +273,317 @@ def ReadTopCdlFile(theStackedChip):
     """
     myTopCell = theStackedChip.find('topCell').text
     myTopCdlFile = theStackedChip.find('topCdlFile').text
-    mySubcktStartRE = re.compile("^\.[sS][uU][bB][cC][kK][tT]\s+(\S+)")
     print("Reading " + myTopCdlFile)
     myCdlFile = OpenFile(myTopCdlFile)
     mySaveInstances = False
-    myLine = ""
+    myLineParts = []  # [line, continuation, ...]
+    myKeepLine = False  # only continue lines that are used
     myInstances = {}  # {instanceName: {'master': masterName, 'nets': portList}, ...}
     myUsedNets = set()
     myNetConnections = set()
+    myStoppedEarly = False
     for line_it in myCdlFile:
-        if line_it.startswith("*"): continue  #ignore comments
-        if not line_it.strip(): continue  #ignore blank lines
-        if line_it.startswith("+"):
-            myLine += " " + line_it[1:]  # remove leading '+'
-        else:
-            if myLine:
-                if myLine.startswith("."):
-                    myMatch = mySubcktStartRE.search(myLine)
-                    if myMatch and myMatch.group(1) == myTopCell:
-                        mySaveInstances = True
-                    else:
-                        mySaveInstances = False
-                if mySaveInstances and myLine.startswith("X"):
+        myFirstChar = line_it[:1]
+        if myFirstChar == "*": continue  #ignore comments
+        if myFirstChar == "+":
+            if myKeepLine:
+                myLineParts.append(line_it[1:])  # remove leading '+'
+        elif not line_it.isspace():  #ignore blank lines
+            if myLineParts:
+                myLine = " ".join(myLineParts)
+                myFirstChar = myLine[:1]
+                if myFirstChar == ".":
+                    mySaveInstances = GetSubcktName(myLine) == myTopCell
+                if mySaveInstances and myFirstChar == "X":
                     myWordList = myLine.split()
                     myInstances[myWordList[0]] = {'master': myWordList[-1],
                                                   'nets': myWordList[1:-1]}
-                    myInstanceNets = set()
-                    for net_it in myWordList[1:-1]:  # unique nets used in this instance
-                        if net_it not in myInstanceNets and net_it != "/":
-                            myInstanceNets.add(net_it)
-                    for net_it in myInstanceNets:
-                        if net_it in myUsedNets:  # 2 or more connections
-                            myNetConnections.add(net_it)
-                        else:  # first connections
-                            myUsedNets.add(net_it)
+                    myInstanceNets = set(myWordList[1:-1])  # unique nets used in this instance
+                    myInstanceNets.discard("/")
+                    myNetConnections |= myInstanceNets & myUsedNets  # 2 or more connections
+                    myUsedNets |= myInstanceNets
                 elif not mySaveInstances and myInstances:  # finished top cell
+                    myStoppedEarly = True
                     break
-            myLine = line_it
+            if mySaveInstances and myInstances and line_it[:5].lower() == ".ends":
+                myStoppedEarly = True
+                break  # end of top cell, skip the rest of the file
+            myLineParts = [line_it]
+            myKeepLine = mySaveInstances or line_it[:1] == "."
+    CloseFile(myCdlFile, myStoppedEarly)
     if not myInstances:
         print("ERROR: Could not find subckt " + myTopCell + " in " + myTopCdlFile)
         raise NameError
     return myInstances, myNetConnections
 
-def BoxContains(theBox, thePoint):
-    """True if theBox (2 tuple list) contains thePoint (tuple)."""
-    return True if (theBox[0][0] <= thePoint[0] and theBox[1][0] >= thePoint[0]
-                    and theBox[0][1] <= thePoint[1] and theBox[1][1] >= thePoint[1]) else False
+def FindContainingBoxes(theBoxes, thePoints):
+    """Return the indices of theBoxes containing each of thePoints.
+
+    Boxes are binned on a grid at least as coarse as the largest box, so that each box is in
+    at most 2x2 cells and each point is only tested against the boxes in its own cell.
+    return: [array of box indices in ascending order, ...] in thePoints order
+    """
+    myPoints = np.array(thePoints, dtype=np.int64).reshape(-1, 2)
+    myBoxes = theBoxes.reshape(-1, 4)  # [(left, bottom, right, top), ...]
+    if len(myBoxes) == 0 or len(myPoints) == 0:
+        return [np.empty(0, dtype=np.int64) for point_it in myPoints]
+    myCellSize = max(int((myBoxes[:, 2:] - myBoxes[:, :2]).max()), 1)
+    myLowCells = myBoxes[:, :2] // myCellSize
+    myHighCells = myBoxes[:, 2:] // myCellSize  # at most 1 more than low cells
+    myOrigin = myLowCells.min(axis=0)
+    myLimit = myHighCells.max(axis=0)
+    myRowCount = myLimit[1] - myOrigin[1] + 1
+    myCellKeys = []  # [array of cell keys, ...]
+    myCellBoxes = []  # [array of box indices, ...]
+    for x_offset in range(0, 2):
+        for y_offset in range(0, 2):
+            myCells = myLowCells + (x_offset, y_offset)
+            myIndexes = np.flatnonzero((myCells <= myHighCells).all(axis=1))
+            myCells = myCells[myIndexes] - myOrigin
+            myCellKeys.append(myCells[:, 0] * myRowCount + myCells[:, 1])
+            myCellBoxes.append(myIndexes)
+    myCellKeys = np.concatenate(myCellKeys)
+    myOrder = np.argsort(myCellKeys, kind='stable')
+    myCellKeys = myCellKeys[myOrder]
+    myCellBoxes = np.concatenate(myCellBoxes)[myOrder]
+    # candidate boxes for each point from its cell
+    myPointCells = myPoints // myCellSize
+    myInGrid = ((myPointCells >= myOrigin) & (myPointCells <= myLimit)).all(axis=1)
+    myPointCells -= myOrigin
+    myPointKeys = myPointCells[:, 0] * myRowCount + myPointCells[:, 1]
+    myStarts = np.searchsorted(myCellKeys, myPointKeys, side='left')
+    myCounts = np.where(myInGrid, np.searchsorted(myCellKeys, myPointKeys, side='right') - myStarts, 0)
+    # test the candidates in blocks of points to limit memory if boxes crowd into a few cells
+    myCandidateEnds = np.cumsum(myCounts)
+    myIndexList = []
+    myFirst = 0
+    while myFirst < len(myPoints):
+        myBase = myCandidateEnds[myFirst] - myCounts[myFirst]  # candidates before this block
+        myLast = max(myFirst + 1,
+                     np.searchsorted(myCandidateEnds, myBase + 1000000, side='right'))
+        myBlockCounts = myCounts[myFirst:myLast]
+        myCandidatePoints = np.repeat(np.arange(myFirst, myLast), myBlockCounts)
+        # position of each candidate within the cell of its point
+        myCellOffsets = (np.arange(len(myCandidatePoints))
+                         - np.repeat(myCandidateEnds[myFirst:myLast] - myBlockCounts - myBase,
+                                     myBlockCounts))
+        myCandidateBoxes = myCellBoxes[np.repeat(myStarts[myFirst:myLast], myBlockCounts)
+                                       + myCellOffsets]
+        myX = myPoints[myCandidatePoints, 0]
+        myY = myPoints[myCandidatePoints, 1]
+        myCandidates = myBoxes[myCandidateBoxes]
+        myContained = ((myCandidates[:, 0] <= myX) & (myCandidates[:, 2] >= myX)
+                       & (myCandidates[:, 1] <= myY) & (myCandidates[:, 3] >= myY))
+        myCandidatePoints = myCandidatePoints[myContained]
+        myCandidateBoxes = myCandidateBoxes[myContained]
+        myOrder = np.lexsort((myCandidateBoxes, myCandidatePoints))
+        myIndexList += np.split(myCandidateBoxes[myOrder],
+                                np.searchsorted(myCandidatePoints[myOrder],
+                                                np.arange(myFirst + 1, myLast)))
+        myFirst = myLast
+    return myIndexList
+
+CDL_SUBCKT_PORTS = {}  # {(cdlFile, modifiedTime): {subcktName: [portName, ...], ...}, ...}
+# .subckt with the rest of its line and following continuation, comment and blank lines.
+# Not anchored with ^ so that the regex engine can scan for the literal prefix.
+CDL_SUBCKT_RE = re.compile(rb"\.subckt(?=\s)[^\n]*(?:\n(?:[+*][^\n]*|[ \t\r\f\v]*(?=\n|\Z)))*",
+                           re.IGNORECASE)
+
+def FindCdlSubcktPorts(theCdlMap):
+    """Return the ports of each subckt in a memory mapped CDL file.
+
+    Only the .subckt statements are decoded; the regex skips device and instance lines in C.
+    return: {subcktName: [portName, ...], ...}
+    """
+    mySubcktPorts = {}  # {subcktName: [portName, ...], ...}
+    for match_it in CDL_SUBCKT_RE.finditer(theCdlMap):
+        myStart = match_it.start()
+        if myStart > 0 and theCdlMap[myStart - 1] != ord("\n"):
+            continue  # .subckt not at the start of a line
+        myLineParts = []  # [line, continuation, ...]
+        for line_it in match_it.group().split(b"\n"):
+            myFirstChar = line_it[:1]
+            if myFirstChar == b"+":
+                myLineParts.append(line_it[1:])  # remove leading '+'
+            elif myFirstChar != b"*":  # .subckt or blank line
+                myLineParts.append(line_it)
+        myWordList = b" ".join(myLineParts).decode().split()
+        if len(myWordList) > 1 and myWordList[1] not in mySubcktPorts:
+            mySubcktPorts[myWordList[1]] = myWordList[2:]
+    return mySubcktPorts
+
+def ReadCdlSubcktPorts(theCdlFile):
+    """Return the ports of each subckt in theCdlFile, reading each file only once.
+
+    return: {subcktName: [portName, ...], ...}
+    """
+    myCacheKey = (theCdlFile, os.path.getmtime(theCdlFile))
+    if myCacheKey in CDL_SUBCKT_PORTS:
+        return CDL_SUBCKT_PORTS[myCacheKey]
+    if not theCdlFile.endswith(".gz") and os.path.getsize(theCdlFile) > 0:
+        myCdlFile = OpenFile(theCdlFile, "rb")
+        with mmap.mmap(myCdlFile.fileno(), 0, access=mmap.ACCESS_READ) as myCdlMap:
+            mySubcktPorts = FindCdlSubcktPorts(myCdlMap)
+        myCdlFile.close()
+        CDL_SUBCKT_PORTS[myCacheKey] = mySubcktPorts
+        return mySubcktPorts
+    myCdlFile = OpenFile(theCdlFile)
+    myLineParts = [""]  # [line, continuation, ...]
+    mySubcktPorts = {}  # {subcktName: [portName, ...], ...}
+    for line_it in myCdlFile:
+        myFirstChar = line_it[:1]
+        if myFirstChar == "*": continue  #ignore comments
+        if myFirstChar == "+":
+            if myLineParts[0][:1] == ".":  # only subckt headers are used
+                myLineParts.append(line_it[1:])  # remove leading '+'
+        elif not line_it.isspace():  #ignore blank lines
+            if myLineParts[0][:1] == ".":
+                myLine = " ".join(myLineParts)
+                mySubcktName = GetSubcktName(myLine)
+                if mySubcktName is not None and mySubcktName not in mySubcktPorts:
+                    mySubcktPorts[mySubcktName] = myLine.split()[2:]
+            myLineParts = [line_it]
+    CloseFile(myCdlFile)
+    CDL_SUBCKT_PORTS[myCacheKey] = mySubcktPorts
+    return mySubcktPorts
 
 def MapCdlPorts(theTopCell, theCdlFile, theParentNetList):
     """Return a dict of theTopCell ports mapped to parent nets.
 
     return: {portName: topNet, ...}
     """
-    mySubcktStartRE = re.compile("^\.[sS][uU][bB][cC][kK][tT]\s+(\S+)")
     print("\nReading " + theCdlFile)
-    myCdlFile = OpenFile(theCdlFile)
-    mySaveInstances = False
-    myLine = ""
+    mySubcktPorts = ReadCdlSubcktPorts(theCdlFile)
+    if theTopCell not in mySubcktPorts:
+        print("ERROR: could not find " + theTopCell + " in " + theCdlFile)
+        raise NameError
     myNetMap = {}  # {portName: topNet, ...}
-    for line_it in myCdlFile:
-        if line_it.startswith("*"): continue  #ignore comments
-        if not line_it.strip(): continue  #ignore blank lines
-        if line_it.startswith("+"):
-            myLine += " " + line_it[1:]  # concatenate after removing leading '+'
-        else:
-            if myLine and myLine.startswith("."):
-                myMatch = mySubcktStartRE.search(myLine)
-                if myMatch and myMatch.group(1) == theTopCell:
-                    myIndex = 0
-                    for net_it in myLine.split()[2:]:
-                        myNetMap[net_it] = theParentNetList[myIndex]
-                        myIndex += 1
-                    return myNetMap
-            myLine = line_it
-    print("ERROR: could not find " + theTopCell + " in " + theCdlFile)
-    raise NameError
+    myIndex = 0
+    for net_it in mySubcktPorts[theTopCell]:
+        myNetMap[net_it] = sys.intern(theParentNetList[myIndex])  # shared by all chips
+        myIndex += 1
+    return myNetMap
+
+LAYER_TYPES = {}  # {(layer, type): "layer-type", ...}
+
+def GetLayerKey(theLayer, theType):
+    """Return the shared "layer-type" string for theLayer and theType."""
+    myKey = (theLayer, theType)
+    if myKey not in LAYER_TYPES:  # one string per layer pair, not per element
+        LAYER_TYPES[myKey] = str(theLayer) + "-" + str(theType)
+    return LAYER_TYPES[myKey]
 
 def CreateStructureIndex(theGdsiiLib):
     """Return a dict of structure indices.
 
+    Also sets the elementKeys of each structure to [(elementType, key), ...] in element order,
+    where key is the decoded child name of SRef/ARef elements and "layer-datatype" or
+    "layer-texttype" of layered elements.
     return: {structureName: structureObject, ...}
     """
     myStructureIndex = {}  # {structureName: structureObject, ...}
+    myChildNames = {}  # {structureNameBytes: structureName, ...}
     for structure_it in theGdsiiLib:
         structure_it.processed = False
+        structure_it.hasPorts = None  # unknown until checked by HasPortLayers
         myStructureIndex[structure_it.name.decode('utf-8')] = structure_it
+        structure_it.elementKeys = []  # [(elementType, childName|layerType|None), ...]
+        for element_it in structure_it:
+            if hasattr(element_it, 'struct_name'):
+                if element_it.struct_name not in myChildNames:
+                    myChildNames[element_it.struct_name] = element_it.struct_name.decode('utf-8')
+                myKey = myChildNames[element_it.struct_name]
+            elif hasattr(element_it, 'layer') and hasattr(element_it, 'data_type'):
+                myKey = GetLayerKey(element_it.layer, element_it.data_type)
+            elif hasattr(element_it, 'layer') and hasattr(element_it, 'text_type'):
+                myKey = GetLayerKey(element_it.layer, element_it.text_type)
+            else:
+                myKey = None
+            structure_it.elementKeys.append((type(element_it), myKey))
     return myStructureIndex
 
 def GetBox(thePointList):
     """"Return the bounding box of the point list."""
-    myMinX = thePointList[0][0]
-    myMaxX = myMinX
-    myMinY = thePointList[0][1]
-    myMaxY = myMinY
-    for xy_it in thePointList[1:]:
-        if myMinX > xy_it[0]:
-            myMinX = xy_it[0]
-        elif myMaxX < xy_it[0]:
-            myMaxX = xy_it[0]
-        if myMinY > xy_it[1]:
-            myMinY = xy_it[1]
-        elif myMaxY < xy_it[1]:
-            myMaxY = xy_it[1]
+    (myMinX, myMinY) = thePointList[0]
+    (myMaxX, myMaxY) = (myMinX, myMinY)
+    for x_it, y_it in thePointList[1:]:  # unpacked once per point
+        if myMinX > x_it:
+            myMinX = x_it
+        elif myMaxX < x_it:
+            myMaxX = x_it
+        if myMinY > y_it:
+            myMinY = y_it
+        elif myMaxY < y_it:
+            myMaxY = y_it
     return([(myMinX, myMinY), (myMaxX, myMaxY)])
 
+PORT_DTYPE = np.dtype([('type', object), ('xy', np.int64, (2,)), ('box', np.int64, (2, 2)),
+                       ('winding', 'U1'), ('textLayer', object)])
+
+def CreatePortTable(theTypes, theCenters, theBoxes, theWindings, theTextLayers):
+    """Return a structured array of ports (PORT_DTYPE).
+
+    return: array of (portType, (x, y), [(x, y), (x, y)], R|L, layer-type)
+            with fields 'type', 'xy', 'box', 'winding', 'textLayer'
+    """
+    myPortTable = np.empty(len(theTypes), dtype=PORT_DTYPE)
+    myPortTable['type'] = theTypes
+    myPortTable['xy'] = np.array(theCenters, dtype=np.int64).reshape(-1, 2)
+    myPortTable['box'] = np.array(theBoxes, dtype=np.int64).reshape(-1, 2, 2)
+    myPortTable['winding'] = theWindings
+    myPortTable['textLayer'] = theTextLayers
+    return myPortTable
+
+def JoinPortTables(thePortTables):
+    """Return a port table with the ports of each of thePortTables in order."""
+    if not thePortTables:
+        return np.empty(0, dtype=PORT_DTYPE)
+    return np.concatenate(thePortTables)
+
+def ExpandArrayPorts(thePortTable, theArray):
+    """Return a port table with thePortTable repeated at each position of theArray (ARef).
+
+    thePortTable: oriented but untranslated ports of the arrayed cell.
+    return: port table in row, column, port order
+    """
+    myXY = np.asarray(theArray.xy, dtype=np.int64)  # [origin, column limit, row limit]
+    myXStep = (myXY[1, 0] - myXY[0, 0]) / theArray.cols
+    myYStep = (myXY[2, 1] - myXY[0, 1]) / theArray.rows
+    myOffsets = np.empty((theArray.rows, theArray.cols, 2), dtype=np.int64)  # truncated like GetTransform
+    myOffsets[:, :, 0] = myXY[0, 0] + np.arange(theArray.cols) * myXStep
+    myOffsets[:, :, 1] = (myXY[0, 1] + np.arange(theArray.rows) * myYStep)[:, np.newaxis]
+    myOffsets = myOffsets.reshape(-1, 1, 2)
+    myPortTable = np.tile(thePortTable, len(myOffsets))
+    myPortTable['xy'] = (thePortTable['xy'][np.newaxis] + myOffsets).reshape(-1, 2)
+    myPortTable['box'] = (thePortTable['box'][np.newaxis]
+                          + myOffsets[:, :, np.newaxis]).reshape(-1, 2, 2)
+    return myPortTable
+
+def HasPortLayers(thePortLayers, theStructureIndex, theTopLayout):
+    """True if theTopLayout or any cell below it has an element on one of thePortLayers.
+
+    Missing cells count as having ports so that PromoteCellPorts reports them.
+    """
+    if theTopLayout not in theStructureIndex:
+        return True
+    myStructure = theStructureIndex[theTopLayout]
+    if myStructure.hasPorts is None:  # Check each structure only once.
+        myStructure.hasPorts = False
+        for elementType_it, key_it in myStructure.elementKeys:
+            if elementType_it is SRef or elementType_it is ARef:
+                myHasPorts = HasPortLayers(thePortLayers, theStructureIndex, key_it)
+            else:
+                myHasPorts = elementType_it is not Text and key_it in thePortLayers
+            if myHasPorts:
+                myStructure.hasPorts = True
+                break
+    return myStructure.hasPorts
+
 def PromoteCellPorts(thePortLayers, thePortCellList, thePortType, theStructureIndex, theTopLayout, 
                      theOrientation="R0", theTranslation=[(0,0)]):
     """Promote low level cell ports to top level.
 
-    return: [{'type': portType, 'xy': pointList[1], 'box': pointList[2], 'winding': R|L,
-              'textLayer': layer-type}, ...]
+    return: port table (PORT_DTYPE array)
     errors: portLayers not in portCells, non-rectangular ports, non-boundary type ports
     """
     if not theTopLayout in theStructureIndex:
@@ -319,97 +591,99 @@ def PromoteCellPorts(thePortLayers, thePortCellList, thePortType, theStructureIn
         raise NameError
     myStructure = theStructureIndex[theTopLayout]
     if not myStructure.processed:  # Do port checks for each structure only once.
-        myStructure.ports = []
-        for element_it in myStructure:
-            if element_it.__class__.__name__ == 'SRef':
-                myStructure.ports += PromoteCellPorts(thePortLayers, thePortCellList,
-                                                      thePortType, theStructureIndex,
-                                                      element_it.struct_name.decode('utf-8'),
-                                                      GetOrientation(element_it), element_it.xy)
-            elif element_it.__class__.__name__ == 'ARef':
-                myXStep = (element_it.xy[1][0] - element_it.xy[0][0]) / element_it.cols
-                myYStep = (element_it.xy[2][1] - element_it.xy[0][1]) / element_it.rows
-                myY = element_it.xy[0][1]
-                myOrientation = GetOrientation(element_it)
-                myChildName = element_it.struct_name.decode('utf-8')
-                for row_it in range(element_it.rows):
-                    myX = element_it.xy[0][0]
-                    for column_it in range(element_it.cols):
-                        myStructure.ports += PromoteCellPorts(thePortLayers, thePortCellList,
-                                                              thePortType, theStructureIndex,
-                                                              myChildName,
-                                                              myOrientation, [(myX, myY)])
-                        myX += myXStep
-                    myY += myYStep
-            elif element_it.__class__.__name__ == 'Boundary':
-                myLayerType = str(element_it.layer) + "-" + str(element_it.data_type)
+        myPortTables = []  # [portTable, ...] in element order
+        for element_it, (elementType_it, key_it) in zip(myStructure, myStructure.elementKeys):
+            if (elementType_it is SRef or elementType_it is ARef) and not HasPortLayers(
+                    thePortLayers, theStructureIndex, key_it):
+                continue  # nothing to promote from this subtree
+            if elementType_it is SRef:
+                myPortTables.append(PromoteCellPorts(thePortLayers, thePortCellList,
+                                                     thePortType, theStructureIndex,
+                                                     key_it,
+                                                     GetOrientation(element_it), element_it.xy))
+            elif elementType_it is ARef:
+                myChildPorts = PromoteCellPorts(thePortLayers, thePortCellList,
+                                                thePortType, theStructureIndex,
+                                                key_it,
+                                                GetOrientation(element_it))
+                if len(myChildPorts):
+                    myPortTables.append(ExpandArrayPorts(myChildPorts, element_it))
+            elif elementType_it is Boundary:
+                myLayerType = key_it
                 if myLayerType in thePortLayers:
                     if theTopLayout not in thePortCellList[myLayerType]:
                         print("Warning: Layer " + myLayerType + " in unexpected cell " 
                               + theTopLayout + " ignored.")
                     else:
                         myBox = GetBox(element_it.xy)
-                        myStructure.ports.append(
-                            {'type': thePortType[theTopLayout]['type'],
-                             'xy': [(0,0)], 'box': myBox, 'winding': 'R',
-                             'textLayer': thePortType[theTopLayout]['textLayer']})
-            elif hasattr(element_it, 'layer') and hasattr(element_it, 'data_type'):
-                myLayerType = str(element_it.layer) + "-" + str(element_it.data_type)
+                        myPortTables.append(CreatePortTable(
+                            [thePortType[theTopLayout]['type']], [(0,0)], [myBox], ['R'],
+                            [thePortType[theTopLayout]['textLayer']]))
+            elif key_it is not None and elementType_it is not Text:  # other layer-datatype elements
+                myLayerType = key_it
                 if myLayerType in thePortLayers:
                     print("Warning: Layer-datatype " + myLayerType + " in unexpected element type "
-                          + element_it.__class__.__name__ + ".")
+                          + elementType_it.__name__ + ".")
+        myStructure.ports = JoinPortTables(myPortTables)
+        myStructure.orientedPorts = {"R0": myStructure.ports}  # {orientation: portTable, ...}
         myStructure.processed = True
-    myPorts = []
-    if myStructure.ports:
-        myTransform = GetTransform(theOrientation, theTranslation)
-        for port_it in myStructure.ports:
-            myPorts.append({'type': port_it['type'], 'xy': Transform(port_it['xy'], myTransform),
-                            'box': NormalizeBox(Transform(port_it['box'], myTransform)),
-                            'winding': FlipPort(port_it['winding'], theOrientation),
-                            'textLayer': port_it['textLayer']})
-    return myPorts
-        
-def LoadGdsPorts(theChip, theStructureIndex, theTopLayout):
-    """Return a list of ports from GDS library.
-
-    return: [{'type': portType, 'xy': pointList[1], 'box': pointList[2],
-              'textLayer': layer-type}, ...]
+    if theOrientation not in myStructure.orientedPorts:  # Orient all ports at once.
+        myPorts = myStructure.ports
+        myTransform = ROTATIONS[theOrientation]
+        myOrientedPorts = myPorts.copy()
+        myOrientedPorts['xy'] = Transform(myPorts['xy'], myTransform)
+        myOrientedPorts['box'] = NormalizeBoxes(Transform(myPorts['box'],
+                                                          myTransform).reshape(-1, 2, 2))
+        if FlipPort('R', theOrientation) == 'L':  # mirrored: reverse all windings
+            myOrientedPorts['winding'] = np.where(myPorts['winding'] == 'R', 'L', 'R')
+        myStructure.orientedPorts[theOrientation] = myOrientedPorts
+    myPorts = myStructure.orientedPorts[theOrientation]  # shared, not modified by callers
+    myOffset = np.array(theTranslation[0], dtype=np.int64)  # truncated like GetTransform
+    if not len(myPorts) or not myOffset.any():
+        return myPorts
+    myPlacedPorts = myPorts.copy()
+    myPlacedPorts['xy'] += myOffset
+    myPlacedPorts['box'] += myOffset
+    return myPlacedPorts
+
+def LoadGdsPorts(theSettings, theStructureIndex, theTopLayout):
+    """Return a table of ports from GDS library.
+
+    return: port table (PORT_DTYPE array)
     """
     myPortLayers = set()
     myPortCellList = {}  # {layer-type: [cell1, cell2, ...], ...}
     myPortType = {}  # {cell: {'type': type, 'textLayer': layer-type}, ...}
-    for port_it in theChip.findall('port'):
-        myLayerType = GetLayerType(port_it)
+    for port_it in theSettings['ports']:
+        myLayerType = port_it['layerType']
         if myLayerType not in myPortLayers:
             myPortLayers.add(myLayerType)
             myPortCellList[myLayerType] = []
-        for portCell_it in port_it.findall('portCell'):
-            myPortCellList[myLayerType].append(portCell_it.text)
-            if portCell_it.text in myPortType:
-                print("ERROR: cell " + portCell_it.text + " is defined as both "
-                      + myPortType[portCell_it.text] + " and " + port_it.find('type').text)
+        for portCell_it in port_it['cells']:
+            myPortCellList[myLayerType].append(portCell_it)
+            if portCell_it in myPortType:
+                print("ERROR: cell " + portCell_it + " is defined as both "
+                      + myPortType[portCell_it]['type'] + " and " + port_it['type'])
             else:
-                myPortText = GetTextType(port_it)
-                myPortType[portCell_it.text] = {'type': port_it.find('type').text,
-                                                'textLayer': GetTextType(port_it)}
-    myPortList = PromoteCellPorts(myPortLayers, myPortCellList, myPortType, 
-                                  theStructureIndex, theTopLayout)
-    return myPortList 
-
-def LoadGdsText(theChip, theTopStructure):
+                myPortType[portCell_it] = {'type': port_it['type'],
+                                           'textLayer': port_it['textLayer']}
+    myPortTable = PromoteCellPorts(myPortLayers, myPortCellList, myPortType, 
+                                   theStructureIndex, theTopLayout)
+    return myPortTable
+
+def LoadGdsText(theSettings, theTopStructure):
     """Return a list of text on the top structure.
 
     return: [{'text': port, 'layer': layer-type, 'xy': point}, ...]
     """
-    myTextLayers = []  # [layer-type, ...]
-    for port_it in theChip.findall('port'):
-        myPortText = GetTextType(port_it)
-        if myPortText != "no text":
-            myTextLayers.append(myPortText)
+    myTextLayers = set()  # {layer-type, ...}
+    for port_it in theSettings['ports']:
+        if port_it['textLayer'] != "no text":
+            myTextLayers.add(port_it['textLayer'])
     myTextList = []  # [{'text': text, 'layer': layer-type, 'xy': [(x, y)]}, ...]
-    for element_it in theTopStructure:
-        if element_it.__class__.__name__ == 'Text':
-            myLayerType = str(element_it.layer) + "-" + str(element_it.text_type)
+    for element_it, (elementType_it, key_it) in zip(theTopStructure, theTopStructure.elementKeys):
+        if elementType_it is Text:
+            myLayerType = key_it
             if myLayerType in myTextLayers:
                 myTextList.append({'text': element_it.string.decode('utf-8'),
                                    'layer': myLayerType,
@@ -422,22 +696,29 @@ def UserScale(thePoint, theScale):
     myY = thePoint[0][1] / theScale
     return("({0:.12g}, {1:.12g})".format(myX, myY))
 
-def GetSize(theBox, theCenter, theTopLayout):
-    """Returns the width and length of theBox.
+def UserScaleList(thePoints, theScale):
+    """Returns each of thePoints scaled to user coordinates, dividing all points at once.
+
+    return: ["(x, y)", ...]
+    """
+    myPoints = (np.array(thePoints, dtype=np.float64).reshape(-1, 2) / theScale).tolist()
+    # %-format is faster than .format with the same .12g output
+    return ["(%.12g, %.12g)" % (x_it, y_it) for x_it, y_it in myPoints]
+
+def GetSizes(thePortTable):
+    """Returns the width and height of each port box, and if the box is not centered on the port.
 
-    return: (width, height)
-    warnings: center of theBox is not theCenter.
+    return: ([[width, height], ...], [offCenter, ...])
     """
-    myWidth = abs(theBox[0][0] - theBox[1][0])
-    myHeight = abs(theBox[0][1] - theBox[1][1])
-    if ( (theBox[0][0] + theBox[1][0]) / 2 != theCenter[0][0]
-         or (theBox[0][1] + theBox[1][1]) / 2 != theCenter[0][1] ):
-        print("Warning: port is not centered at " + str(theCenter[0]) + " in " + theTopLayout)
-    return([myWidth, myHeight])
+    myBoxes = thePortTable['box']
+    mySizes = np.abs(myBoxes[:, 1] - myBoxes[:, 0])
+    myOffCenter = (myBoxes[:, 0] + myBoxes[:, 1] != 2 * thePortTable['xy']).any(axis=1)
+    return (mySizes.tolist(), myOffCenter.tolist())
 
-def AssignPorts(thePortList, theTextList, theTopLayout, theDbuPerUU):
+def AssignPorts(thePortTable, theTextList, theTopLayout, theDbuPerUU):
     """Return a list of text with port type centered at port origin.
 
+    thePortTable: port table (PORT_DTYPE array)
     return: [{'text': port, 'type': portType, 'xy': portCenter,
               'size': (width, height), 'winding': R|L}, ...]
     errors: text mapped to multiple ports, text not mapped to any port.
@@ -445,50 +726,62 @@ def AssignPorts(thePortList, theTextList, theTopLayout, theDbuPerUU):
     myNamedPortList = []  # [{'text': port, 'type': portType, 'xy': [(x, y)],
                           #   'size': (width, length), 'winding': R|L}, ...]
     myUnmapCount = 0
-    print("Mapping " + str(len(theTextList)) + " texts to " + str(len(thePortList)) + " ports")
-    for text_it in theTextList:
+    myPortCount = len(thePortTable)
+    print("Mapping " + str(len(theTextList)) + " texts to " + str(myPortCount) + " ports")
+    myXYList = [[tuple(xy_it)] for xy_it in thePortTable['xy'].tolist()]
+    (mySizes, myOffCenter) = GetSizes(thePortTable)  # checked for all ports at once
+    myTypes = thePortTable['type'].tolist()
+    myWindings = thePortTable['winding'].tolist()
+    myTextLayers = thePortTable['textLayer'].tolist()
+    myAssigned = np.zeros(myPortCount, dtype=bool)
+    myTextPoints = np.fromiter((coordinate_it for text_it in theTextList
+                                for coordinate_it in text_it['xy'][0]),
+                               dtype=np.int64, count=2 * len(theTextList)).reshape(-1, 2)
+    myPortIndexList = FindContainingBoxes(thePortTable['box'], myTextPoints)
+    for text_it, portIndexes_it in zip(theTextList, myPortIndexList):
         myTextFound = False
-        for port_it in thePortList:
-            if BoxContains(port_it['box'], text_it['xy'][0]):
-                if myTextFound and myXY != port_it['xy']:
-                    print("Warning: Text in multiple ports: " + text_it['text']
-                          + " at " + UserScale(myXY, theDbuPerUU) + " and "
-                          + UserScale(text_it['xy'], theDbuPerUU) + " in " + theTopLayout)
-                    myUnmapCount += 1
-                elif text_it['layer'] != port_it['textLayer']:
-                    print("Warning: " + text_it['text']
-                          + " at " + UserScale(port_it['xy'], theDbuPerUU)
-                          + " on layer " + text_it['layer'] + " does not match expected " 
-                          + port_it['textLayer'] + " for port " + port_it['type'])
-                    myUnmapCount += 1
-                else:                    
-                    myNamedPortList.append({'text': text_it['text'],
-                                            'type': port_it['type'],
-                                            'xy': port_it['xy'],
-                                            'size': GetSize(port_it['box'],
-                                                            port_it['xy'],
-                                                            theTopLayout),
-                                            'winding': port_it['winding']})
-                    port_it['assigned'] = True
-                    myTextFound = True
-                    myXY = port_it['xy']
+        for portIndex_it in portIndexes_it:
+            if myTextFound and myXY != myXYList[portIndex_it]:
+                print("Warning: Text in multiple ports: " + text_it['text']
+                      + " at " + UserScale(myXY, theDbuPerUU) + " and "
+                      + UserScale(text_it['xy'], theDbuPerUU) + " in " + theTopLayout)
+                myUnmapCount += 1
+            elif text_it['layer'] != myTextLayers[portIndex_it]:
+                print("Warning: " + text_it['text']
+                      + " at " + UserScale(myXYList[portIndex_it], theDbuPerUU)
+                      + " on layer " + text_it['layer'] + " does not match expected " 
+                      + myTextLayers[portIndex_it]
+                      + " for port " + myTypes[portIndex_it])
+                myUnmapCount += 1
+            else:                    
+                if myOffCenter[portIndex_it]:
+                    print("Warning: port is not centered at " + str(myXYList[portIndex_it][0])
+                          + " in " + theTopLayout)
+                myNamedPortList.append({'text': text_it['text'],
+                                        'type': myTypes[portIndex_it],
+                                        'xy': myXYList[portIndex_it],
+                                        'size': list(mySizes[portIndex_it]),
+                                        'winding': myWindings[portIndex_it]})
+                myAssigned[portIndex_it] = True
+                myTextFound = True
+                myXY = myXYList[portIndex_it]
         if not myTextFound:
             myUnmapCount += 1
     myMissingTextCount = 0
-    for port_it in thePortList:
-        if not 'assigned' in port_it:  # Check blank ports.
-            if port_it['textLayer'] == "no text":
-                myText = ""
-            else:
-                myText = "*MISSING TEXT*"
-                myMissingTextCount += 1
-            myNamedPortList.append({'text': myText,
-                                    'type': port_it['type'],
-                                    'xy': port_it['xy'],
-                                    'size': GetSize(port_it['box'],
-                                                    port_it['xy'],
-                                                    theTopLayout),
-                                    'winding': port_it['winding']})
+    for portIndex_it in np.flatnonzero(~myAssigned):  # Check blank ports.
+        if myTextLayers[portIndex_it] == "no text":
+            myText = ""
+        else:
+            myText = "*MISSING TEXT*"
+            myMissingTextCount += 1
+        if myOffCenter[portIndex_it]:
+            print("Warning: port is not centered at " + str(myXYList[portIndex_it][0])
+                  + " in " + theTopLayout)
+        myNamedPortList.append({'text': myText,
+                                'type': myTypes[portIndex_it],
+                                'xy': myXYList[portIndex_it],
+                                'size': list(mySizes[portIndex_it]),
+                                'winding': myWindings[portIndex_it]})
     print(str(myUnmapCount) + " text ignored. " + str(myMissingTextCount) + " ports without text.")
     return myNamedPortList
 
@@ -501,34 +794,67 @@ def TranslateChipPorts(thePortList, theOrientation, theTranslation, theScale):
                              #   'size': "(width x height)", 'winding': R|L}, ...]
     myTransform = GetTransform(theOrientation, theTranslation)
     mySwitchSize = "R90" in theOrientation or "R270" in theOrientation
-    for port_it in thePortList:
-        mySize = port_it['size'].reverse() if mySwitchSize else port_it['size']
+    myXYList = UserScaleList(Transform([port_it['xy'][0] for port_it in thePortList],
+                                       myTransform), theScale)  # all ports at once
+    mySizeList = UserScaleList([port_it['size'][::-1] if mySwitchSize else port_it['size']
+                                for port_it in thePortList], theScale)
+    for port_it, xy_it, size_it in zip(thePortList, myXYList, mySizeList):
         myInstancePortList.append({'text': port_it['text'],
                                    'type': port_it['type'],
-                                   'xy': UserScale(Transform(port_it['xy'], myTransform),
-                                                   theScale),
-                                   'size': UserScale([mySize], theScale).replace(", ", "x"),
+                                   'xy': xy_it,
+                                   'size': size_it.replace(", ", "x"),
                                    'winding': FlipPort(port_it['winding'], theOrientation)})
     return myInstancePortList
 
-def GetGdsPortData(theChip, theUserUnits):
+def GetChipSettings(theChip):
+    """Return the chip settings read from the xml chip element.
+
+    return: {'instanceName': name, 'cdlFileName': file, 'subcktName': name|None,
+             'gdsFileName': file, 'layoutName': name, 'orientation': orientation,
+             'offset': (x, y), 'shrink': shrink, 'portFile': file|"",
+             'ports': [{'type': portType, 'layerType': layer-type,
+                        'textLayer': layer-type|"no text", 'cells': [cell, ...]}, ...]}
+    """
+    mySettings = {'ports': []}
+    for child_it in theChip:
+        if child_it.tag in mySettings:
+            continue  # the first element is used, as by find()
+        if child_it.tag in ('instanceName', 'cdlFileName', 'subcktName', 'gdsFileName',
+                            'layoutName', 'orientation', 'portFile'):
+            mySettings[child_it.tag] = child_it.text
+        elif child_it.tag == 'offset':
+            mySettings['offset'] = (float(child_it.find('x').text),
+                                    float(child_it.find('y').text))
+        elif child_it.tag == 'shrink':
+            mySettings['shrink'] = float(child_it.text)
+        elif child_it.tag == 'port':
+            mySettings['ports'].append(
+                {'type': child_it.find('type').text,
+                 'layerType': GetLayerType(child_it),
+                 'textLayer': GetTextType(child_it),
+                 'cells': [cell_it.text for cell_it in child_it.findall('portCell')]})
+    mySettings.setdefault('subcktName', None)
+    mySettings.setdefault('portFile', "")
+    return mySettings
+
+def GetGdsPortData(theSettings, theUserUnits):
     """Translate GDS port data to final positions.
 
     return: [{'text': port, 'type': portType, 'xy': "(x, y)",
               'size': "(width x height)", 'winding': R|L}, ...]
     Note: x, y in user units.
     """
-    myLayoutName = theChip.find('layoutName').text
-    myGdsFileName = theChip.find('gdsFileName').text
-    myOrientation = theChip.find('orientation').text
-    myShrink = float(theChip.find('shrink').text)
+    myLayoutName = theSettings['layoutName']
+    myGdsFileName = theSettings['gdsFileName']
+    myOrientation = theSettings['orientation']
+    myShrink = theSettings['shrink']
     print("Reading " + myGdsFileName)
-    myGdsFile = OpenFile(myGdsFileName, "rb")
+    myGdsFile = OpenGdsFile(myGdsFileName)
     myGdsiiLib = Library.load(myGdsFile)
+    CloseFile(myGdsFile)  # reaps the decompression process of .gz files
     myInternalDbuPerUU = 1 / myGdsiiLib.logical_unit
-    myOffset = theChip.find('offset')
-    myX = float(myOffset.find('x').text) * myInternalDbuPerUU
-    myY = float(myOffset.find('y').text) * myInternalDbuPerUU
+    myX = theSettings['offset'][0] * myInternalDbuPerUU
+    myY = theSettings['offset'][1] * myInternalDbuPerUU
     if theUserUnits == 'um':
         myOutputDbuPerUU = 1e-6 / myGdsiiLib.physical_unit
     elif theUserUnits == 'nm':
@@ -537,14 +863,37 @@ def GetGdsPortData(theChip, theUserUnits):
         raise ValueError
     myStructureIndex = CreateStructureIndex(myGdsiiLib)
     print("Loading ports...")
-    myPortList = LoadGdsPorts(theChip, myStructureIndex, myLayoutName)
-    myTextList = LoadGdsText(theChip, myStructureIndex[myLayoutName])
+    myPortTable = LoadGdsPorts(theSettings, myStructureIndex, myLayoutName)
+    myTextList = LoadGdsText(theSettings, myStructureIndex[myLayoutName])
     print("Assigning text...")
-    myNamedPortList = AssignPorts(myPortList, myTextList, myLayoutName, myInternalDbuPerUU)
+    myNamedPortList = AssignPorts(myPortTable, myTextList, myLayoutName, myInternalDbuPerUU)
     return TranslateChipPorts(myNamedPortList, myOrientation, [(myX, myY)],
                               myOutputDbuPerUU / myShrink)
 
-def LoadPortData(theChip, theUserUnits, theInstance, theUseText):
+def ReadPortFile(thePortFileName):
+    """Return the port data in a .pkl (pickle) or json port file."""
+    if thePortFileName.endswith(".pkl"):
+        with open(thePortFileName, "rb") as myPortFile:
+            return pickle.load(myPortFile)
+    if orjson:
+        with open(thePortFileName, "rb") as myPortFile:
+            return orjson.loads(myPortFile.read())
+    with open(thePortFileName, encoding="utf-8") as myPortFile:
+        return json.load(myPortFile)
+
+def WritePortFile(thePortFileName, thePortData):
+    """Write the port data to a .pkl (pickle) or json port file."""
+    if thePortFileName.endswith(".pkl"):
+        with open(thePortFileName, "wb") as myPortFile:
+            pickle.dump(thePortData, myPortFile, protocol=pickle.HIGHEST_PROTOCOL)
+    elif orjson:
+        with open(thePortFileName, "wb") as myPortFile:
+            myPortFile.write(orjson.dumps(thePortData, option=orjson.OPT_INDENT_2))
+    else:
+        with open(thePortFileName, "w", encoding="utf-8") as myPortFile:
+            json.dump(thePortData, myPortFile, ensure_ascii=False, indent=2)
+
+def LoadPortData(theSettings, theUserUnits, theInstance, theUseText):
     """Loads port data from file if specified and exists, or from GDS otherwise.
 
     modifies:
@@ -552,136 +901,226 @@ def LoadPortData(theChip, theUserUnits, theInstance, theUseText):
     return: [{'text': port, 'type': portType, 'xy': "(x, y)",
               'size': "(width x height)", 'winding': R|L}, ...]
     """
-    myPortFileName = theChip.find('portFile').text if theChip.find('portFile') is not None else ""
+    myPortFileName = theSettings['portFile']
     if theUseText:  # port data from text file
         if myPortFileName == "":
-            print("ERROR: 'portFile' of " + theChip.find('instanceName').text
+            print("ERROR: 'portFile' of " + theSettings['instanceName']
                   + " must be set for text input mode")
             raise
         try:
-            with open(myPortFileName) as myPortFile:
-                myPortData = json.load(myPortFile)
+            myPortData = ReadPortFile(myPortFileName)
             print("INFO: reading port data for instance " +
-                  theChip.find('instanceName').text + " from " + myPortFileName)
+                  theSettings['instanceName'] + " from " + myPortFileName)
             theInstance['source'] = "file"
         except Exception as myError:
             print(myError)
             print("ERROR: Could not read port data for instance " +
-                  theChip.find('instanceName').text + " from " + myPortFileName)
+                  theSettings['instanceName'] + " from " + myPortFileName)
             raise
     else:  # port data from GDS
-        myPortData = GetGdsPortData(theChip, theUserUnits)
+        myPortData = GetGdsPortData(theSettings, theUserUnits)
         theInstance['source'] = "GDS"
         if myPortFileName != "":
             print("INFO: writing port data for instance " +
-                  theChip.find('instanceName').text + " to " + myPortFileName)
-            with open(myPortFileName, "w") as myPortFile:
-                json.dump(myPortData, myPortFile, ensure_ascii=False, indent=2)
+                  theSettings['instanceName'] + " to " + myPortFileName)
+            WritePortFile(myPortFileName, myPortData)
     return myPortData
 
+def ParseXY(theXY):
+    """Return the numeric (x, y) of an "(x, y)" coordinate string."""
+    (myX, mySeparator, myY) = theXY[1:-1].partition(",")
+    return (float(myX) + 0.0, float(myY) + 0.0)  # + 0.0 so that -0 == 0
+
 def PromoteChipPorts(theChip, theInstances, theUserUnits, theUseText):
     """Promote individual chip ports to virtual top level.
 
-    return: {(instanceName, "(x, y)", portType, topNet): (portName, size, winding), ...}
+    return: {(instanceName, (x, y), portType, topNet): (portName, size, winding), ...}
     """
-    myInstanceName = theChip.find('instanceName').text
-    myCdlFile = theChip.find('cdlFileName').text
-    if theChip.find('subcktName') is None:
+    mySettings = GetChipSettings(theChip)  # read the chip element once
+    myInstanceName = mySettings['instanceName']
+    myCdlFile = mySettings['cdlFileName']
+    if mySettings['subcktName'] is None:
         myMasterSubckt = theInstances[myInstanceName]['master']
     else:
-        myMasterSubckt = theChip.find('subcktName').text
+        myMasterSubckt = mySettings['subcktName']
     myCdlPortMap = MapCdlPorts(myMasterSubckt, myCdlFile, theInstances[myInstanceName]['nets'])
-    myGdsPortData = LoadPortData(theChip, theUserUnits, theInstances[myInstanceName], theUseText)
-    myMappedPorts = {}  # {(instanceName, "(x, y)", portType, topNet):
+    myGdsPortData = LoadPortData(mySettings, theUserUnits, theInstances[myInstanceName],
+                                 theUseText)
+    myMappedPorts = {}  # {(instanceName, (x, y), portType, topNet):
                         #  (portName, size, winding), ...}
     for net_it in myCdlPortMap:  # Added entry to handle connected CDL nets without ports
         myKey = (myInstanceName, "", "", myCdlPortMap[net_it])
         myMappedPorts[myKey] = (net_it, "", "")
     for port_it in myGdsPortData:
+        myType = sys.intern(port_it['type'])  # port types are compared for every report row
         if port_it['text']:
             if port_it['text'] in myCdlPortMap:
-                myKey = (myInstanceName, port_it['xy'], port_it['type'],
+                myKey = (myInstanceName, ParseXY(port_it['xy']), myType,
                          myCdlPortMap[port_it['text']])
             else:
-                myKey = (myInstanceName, port_it['xy'], port_it['type'], "????")
+                myKey = (myInstanceName, ParseXY(port_it['xy']), myType, "????")
             myMappedPorts[myKey] = (port_it['text'], port_it['size'], port_it['winding'])
         else:  # unlabeled port
-            if port_it['type'] == "TSV":
-                myKey = (myInstanceName, port_it['xy'], port_it['type'], "")
+            if myType == "TSV":
+                myKey = (myInstanceName, ParseXY(port_it['xy']), myType, "")
                 myMappedPorts[myKey] = ("", port_it['size'], "")
             else:
                 print("ERROR: " + port_it['type'] + " without text at " + port_it['xy'])
     return myMappedPorts
 
+def PromoteChipPortsJob(theJob):
+    """Promote the ports of one chip in a worker process.
+
+    theJob: (xmlFileName, chipIndex, instances, userUnits, useText)
+    return: (promoted ports, port data source, captured output)
+    """
+    (myXmlFileName, myChipIndex, myInstances, myUserUnits, myUseText) = theJob
+    myChip = ET.parse(myXmlFileName).getroot().findall('chip')[myChipIndex]
+    myLog = io.StringIO()
+    try:
+        with redirect_stdout(myLog):
+            myPortData = PromoteChipPorts(myChip, myInstances, myUserUnits, myUseText)
+    except:
+        sys.stdout.write(myLog.getvalue())
+        raise
+    mySource = myInstances[GetChipSettings(myChip)['instanceName']]['source']
+    return (myPortData, mySource, myLog.getvalue())
+
+INDEX_PATTERNS = {  # {closing bracket: (compiled regex, sort key format), ...}
+    "]": (re.compile(r"(.*)\[([0-9]*)\]$"), "{0:s}[{1:010d}] ".format),
+    ">": (re.compile(r"(.*)<([0-9]*)>$"), "{0:s}<{1:010d}> ".format),
+    ")": (re.compile(r"(.*)\(([0-9]*)\)$"), "{0:s}({1:010d}) ".format),
+    "}": (re.compile(r"(.*)\{([0-9]*)\}$"), "{0:s}{{{1:010d}}} ".format)}
+
 def CreateSortKey(theValue):
     """Return a key for sorting with indices in numerical order and xy numerically ascending.
 
-    Offset the coordinates by 100,000uu so that alphabetical sort = numerical sort.
-    Eg. without offset (-40, 0), (-10, 0) -> (-00010, 00000), (-00040, 00000)
-    with 10000 offset (-40, 0), (-10, 0) -> (09960, 10000), (09990, 10000)
+    return: ("text " or "name[0000000012] ", x, y)
+    Net names do not contain spaces, so comparing the text part then the rounded coordinates
+    orders ports the same as the formatted key string "name[0000000012] +x +y".
+    Coordinates are offset by 1,000,000uu and rounded to 5 decimal places as in that string.
     """
     (myText, myType, myXY) = theValue
     if myXY != "":
-        (myX, myY) = literal_eval(myXY)
+        (myX, myY) = myXY
     else:
         (myX, myY) = (2e6, 2e6)  # default coordinate key for netlist only text
-    if myText.endswith("]"):
-        myMatch = re.match(r"(.*)\[([0-9]*)\]$", myText)
-        if myMatch:
-            return("{0:s}[{1:010d}] {2:+020.5f} {3:+020.5f}".format(
-                myMatch.group(1), int(myMatch.group(2)), 1e6+float(myX), 1e6+float(myY)))
-    elif myText.endswith(">"):
-        myMatch = re.match("(.*)<([0-9]*)>$", myText)
-        if myMatch:
-            return("{0:s}<{1:010d}> {2:+020.5f} {3:+020.5f}".format(
-                myMatch.group(1), int(myMatch.group(2)), 1e6+float(myX), 1e6+float(myY)))
-    elif myText.endswith(")"):
-        myMatch = re.match(r"(.*)\(([0-9]*)\)$", myText)
-        if myMatch:
-            return("{0:s}({1:010d}) {2:+020.5f} {3:+020.5f}".format(
-                myMatch.group(1), int(myMatch.group(2)), 1e6+float(myX), 1e6+float(myY)))
-    elif myText.endswith("}"):
-        myMatch = re.match(r"(.*)\{([0-9]*)\}$", myText)
+    myXKey = round(1e6 + myX, 5)
+    myYKey = round(1e6 + myY, 5)
+    myIndexPattern = INDEX_PATTERNS.get(myText[-1:])
+    if myIndexPattern:
+        (myRegex, myFormat) = myIndexPattern
+        myMatch = myRegex.match(myText)
         if myMatch:
-            return("{0:s}{{{1:010d}}} {2:+020.5f} {3:+020.5f}".format(
-                myMatch.group(1), int(myMatch.group(2)), 1e6+float(myX), 1e6+float(myY)))
-    return("{0:s} {1:+020.5f} {2:+020.5f}".format(myText, 1e6+float(myX), 1e6+float(myY)))
+            return (myFormat(myMatch.group(1), int(myMatch.group(2))), myXKey, myYKey)
+    return (myText + " ", myXKey, myYKey)
 
 def CreateSearchList(theXY, theTolerance):
-    """Return a list of coordinates for 2x2 array of points rounded to tolerance.
+    """Return a list of keys for 2x2 array of points rounded to tolerance.
 
-    return ["(x, y)", "(x, y+t)", "(x+t, y)", "(x+t, y+t)"] or ["(x, y)"]
+    Keys are the integer multiples of the tolerance.
+    return [(x, y), (x, y+1), (x+1, y), (x+1, y+1)] or [(x, y)]
     """
     if theTolerance > 0.000001:  # ignore tolerance less than 1e-6 user units
-        (myX, myY) = literal_eval(theXY)
-        myRoundedX = round(myX / theTolerance) * theTolerance
-        myRoundedY = round(myY / theTolerance) * theTolerance
-        myKeyList = []  # ["(x, y)", ...]
-        for x_offset in range(0, 2):
-            for y_offset in range(0, 2):
-                myKeyList.append(
-                    "({0:.12g}, {1:.12g})".format(myRoundedX + theTolerance * x_offset,
-                                                  myRoundedY + theTolerance * y_offset))
-    else:
-        myKeyList = [theXY]
-    return myKeyList
+        myRoundedX = round(theXY[0] / theTolerance)
+        myRoundedY = round(theXY[1] / theTolerance)
+        return [(myRoundedX, myRoundedY), (myRoundedX, myRoundedY + 1),
+                (myRoundedX + 1, myRoundedY), (myRoundedX + 1, myRoundedY + 1)]
+    return [theXY]
+
+TOLERANCE_LIMITS = {}  # {tolerance: largest distance within tolerance, ...}
+
+def GetToleranceLimit(theTolerance):
+    """Return the largest distance that is within theTolerance.
 
-def CreateXyList(thePortIndex, theSortedPorts, theTolerance):
+    A distance is within tolerance if round(distance / theTolerance * 100000) <= 100000.
+    That is monotonic in distance, so the limit is found once by bisecting between adjacent
+    floats and the check becomes distance <= limit, without dividing or rounding.
+    """
+    if theTolerance not in TOLERANCE_LIMITS:
+        if theTolerance == 0:
+            print("ERROR: Tolerance must not be 0")
+            raise ValueError
+        if theTolerance < 0 or math.isinf(theTolerance):  # every distance is within tolerance
+            TOLERANCE_LIMITS[theTolerance] = math.inf
+            return math.inf
+        myLow = theTolerance  # within
+        myHigh = theTolerance * 1.00001  # outside
+        while True:
+            myMiddle = myLow + (myHigh - myLow) / 2
+            if myMiddle == myLow or myMiddle == myHigh:
+                break
+            if round(myMiddle / theTolerance * 100000) > 100000:
+                myHigh = myMiddle
+            else:
+                myLow = myMiddle
+        TOLERANCE_LIMITS[theTolerance] = myLow
+    return TOLERANCE_LIMITS[theTolerance]
+
+def CreateXyIndex(theSortedPorts):
+    """Return the coordinate columns and (text, type) runs of the sorted ports for CreateXyList.
+
+    return: ([x, ...], array of y, [end of the run containing each port, ...],
+             [True if x is ascending from each port to the end of its run, ...])
+    """
+    myPortCount = len(theSortedPorts)
+    myXs = [math.nan] * myPortCount  # netlist only text has no coordinates
+    myYs = np.full(myPortCount, math.nan)
+    myRunEnds = [myPortCount] * myPortCount
+    myAscending = [True] * myPortCount
+    for port_it in range(myPortCount - 1, -1, -1):
+        (myText, myType, myXY) = theSortedPorts[port_it]
+        if myXY != "":
+            (myXs[port_it], myYs[port_it]) = myXY
+        if port_it + 1 < myPortCount and theSortedPorts[port_it + 1][:2] == (myText, myType):
+            myRunEnds[port_it] = myRunEnds[port_it + 1]
+            myAscending[port_it] = (myAscending[port_it + 1]
+                                    and myXs[port_it] <= myXs[port_it + 1])
+        else:
+            myRunEnds[port_it] = port_it + 1
+    return (myXs, myYs, myRunEnds, myAscending)
+
+def CreateXyList(thePortIndex, theSortedPorts, theTolerance, theXyIndex):
     """Return a list of actual point coordinates with the tolerance of first point.
 
-    return ["(x, y)", ...]
+    theXyIndex: CreateXyIndex(theSortedPorts)
+    return [(x, y), ...]
     """
     (myText, myType, myXY) = theSortedPorts[thePortIndex]
     myXyList = [myXY]
-    (myX, myY) = literal_eval(myXY)
-    for nextPort_it in range(thePortIndex+1, len(theSortedPorts)):
+    (myX, myY) = myXY
+    (myXs, myYs, myRunEnds, myAscending) = theXyIndex
+    myRunEnd = myRunEnds[thePortIndex]
+    if myRunEnd == thePortIndex + 1:  # no other ports with the same text and type
+        return myXyList
+    myLimit = GetToleranceLimit(theTolerance)
+    if myAscending[thePortIndex]:
+        # x - myX ascends in the run, so binary search the end of the ports within x tolerance,
+        # then check y of those ports (in numpy for long columns of ports).
+        myLow = thePortIndex + 1
+        myHigh = myRunEnd
+        while myLow < myHigh:
+            myMiddle = (myLow + myHigh) // 2
+            if myXs[myMiddle] - myX > myLimit:
+                myHigh = myMiddle
+            else:
+                myLow = myMiddle + 1
+        if myLow - thePortIndex > 64:  # faster than the loop below for long windows
+            myNearIndexes = np.flatnonzero(np.abs(myYs[thePortIndex+1:myLow] - myY) <= myLimit)
+            for index_it in myNearIndexes.tolist():
+                myXyList.append(theSortedPorts[thePortIndex + 1 + index_it][2])
+            return myXyList
+        for nextPort_it in range(thePortIndex+1, myLow):
+            myNextXY = theSortedPorts[nextPort_it][2]
+            if abs(myNextXY[1] - myY) <= myLimit:
+                myXyList.append(myNextXY)
+        return myXyList
+    for nextPort_it in range(thePortIndex+1, myRunEnd):
         # Get XY of ports within tolerance
-        (myNextText, myNextType, myNextXY) = theSortedPorts[nextPort_it]
-        if not (myNextText == myText and myNextType == myType): break
-        (myNextX, myNextY) = literal_eval(myNextXY)
-        if round(abs(myNextX - myX) / theTolerance * 100000) > 100000: break
-        if round(abs(myNextY - myY) / theTolerance * 100000) <= 100000:
-            myXyList.append(myNextXY)
+        (myNextX, myNextY) = theSortedPorts[nextPort_it][2]
+        if abs(myNextX - myX) > myLimit: break
+        if abs(myNextY - myY) <= myLimit:
+            myXyList.append(theSortedPorts[nextPort_it][2])
     return myXyList
 
 def CreatePortLists(thePortData, theTolerance):
@@ -689,8 +1128,8 @@ def CreatePortLists(thePortData, theTolerance):
 
     Returns: (set((text, type, xy), ...), {(type, roundedXY): set(xy, ...)})
     """
-    myFinalPorts = set()  # ((text, type, "(x, y)"), ...)
-    myBlankPorts = {}  # {(type, "(x, y)"): set("(x, y)", ...), ...}
+    myFinalPorts = set()  # ((text, type, (x, y)), ...)
+    myBlankPorts = {}  # {(type, (roundedX, roundedY)): set((x, y), ...), ...}
     for portKey_it in thePortData:  # Create top level port list.
         (myInstance, myXY, myType, myText) = portKey_it
         if myText == "":
@@ -704,26 +1143,21 @@ def CreatePortLists(thePortData, theTolerance):
             myFinalPorts.add((myText, myType, myXY))
     return((sorted(myFinalPorts, key=CreateSortKey), myBlankPorts))
 
-def WithinTolerance(theFirstXY, theSecondXY, theTolerance):
-    """True if the x and y coordinates of 2 points are within the tolerance."""
-    (myFirstX, myFirstY) = literal_eval(theFirstXY)
-    (mySecondX, mySecondY) = literal_eval(theSecondXY)
-    if round(abs(myFirstX - mySecondX) / theTolerance * 100000) > 100000: return False
-    if round(abs(myFirstY - mySecondY) / theTolerance * 100000) > 100000: return False
-    return True
-
 def HasBlankPort(theInstance, theType, theXY, theTolerance, theBlankPorts, thePortData):
     """Returns the blank port on instance within tolerance."""
-    myKeyList = CreateSearchList(theXY, theTolerance)
-    myPortFound = False
-    for key_it in myKeyList:
-        myBlankKey = (theType, key_it)
-        if myBlankKey in theBlankPorts:
-            for blankXY_it in theBlankPorts[myBlankKey]:
-                if WithinTolerance(theXY, blankXY_it, theTolerance):     
-                    myPortKey = (theInstance, blankXY_it, theType, "")
-                    if myPortKey in thePortData:
-                        return myPortKey
+    (myX, myY) = theXY
+    myLimit = None  # looked up at the first candidate
+    for key_it in CreateSearchList(theXY, theTolerance):
+        myBlankXYs = theBlankPorts.get((theType, key_it))
+        if not myBlankXYs: continue
+        if myLimit is None:
+            myLimit = GetToleranceLimit(theTolerance)
+        for blankXY_it in myBlankXYs:  # candidates in this tolerance cell
+            (myBlankX, myBlankY) = blankXY_it
+            if abs(myX - myBlankX) <= myLimit and abs(myY - myBlankY) <= myLimit:
+                myPortKey = (theInstance, blankXY_it, theType, "")
+                if myPortKey in thePortData:
+                    return myPortKey
     return None
 
 def MultiplePorts(thePortIndex, theSortedPorts, thePrintedPorts):
@@ -732,9 +1166,8 @@ def MultiplePorts(thePortIndex, theSortedPorts, thePrintedPorts):
     for nextPort_it in range(thePortIndex + 1, len(theSortedPorts)):  # Check for duplicate ports
         (myNextText, myNextType, myNextXY) = theSortedPorts[nextPort_it]
         if myNextText != myText: break  # different text
-        if (myNextText, myNextXY) in thePrintedPorts: continue  # Already printed (same port)
         if myNextXY == "": continue  # dummy port
-        if myText == myNextText:  # Coil text must be unique (look ahead)
+        if (myNextText, myNextXY) not in thePrintedPorts:  # Coil text must be unique (look ahead)
             return True
     return False
 
@@ -758,10 +1191,13 @@ def CheckPortData(thePortData, theInstanceOrder, theInstances, theTolerance,
                   theOutputFile, theNetConnections):
     """Check the promoted ports' alignment, size and winding."""
     (mySortedPorts, myBlankPorts) = CreatePortLists(thePortData, theTolerance)
+    myXyIndex = CreateXyIndex(mySortedPorts)
+    myTextCounts = Counter(port_it[0] for port_it in mySortedPorts)  # {text: port count, ...}
     myPrintedPorts = set()
     myUsedCoils = set()
     myLastText = ""
     myUsedBlankPorts = set()
+    myOutputLines = []  # ["status,text,type,xy,slice,...\n", ...]
     for port_it in range(len(mySortedPorts)):
         (myText, myType, myXY) = mySortedPorts[port_it]
         myPortStatus = "OK"
@@ -772,16 +1208,18 @@ def CheckPortData(thePortData, theInstanceOrder, theInstances, theTolerance,
             if myText == myLastText or myText not in theNetConnections: continue
             # CDL net without layout port
             myPortStatus = "NO_PORT"
-            myOutput = myText + ",,,"
+            myOutput = [myText, "", "", ""]
             myXyList = [""]
         else:
-            (myX, myY) = literal_eval(myXY)
-            myXyList = CreateXyList(port_it, mySortedPorts, theTolerance)
+            (myX, myY) = myXY
+            myXyList = CreateXyList(port_it, mySortedPorts, theTolerance, myXyIndex)
             for xy_it in myXyList:
                 myPrintedPorts.add((myText, xy_it))
-            myOutput = myText + "," + myType + "," + "{:.12g}, {:.12g}".format(myX, myY)
+            myOutput = [myText, myType, "{:.12g}, {:.12g}".format(myX, myY)]
             if myText == "????":
                 myPortStatus = "NO_NET"
+        myIsCoil = myType.startswith("COIL")  # checked for each instance
+        myIsTsv = myType.startswith("TSV")
         myConnectionCount = 0
         myPortSize = 0
         myPortInstanceSet = set()
@@ -791,49 +1229,50 @@ def CheckPortData(thePortData, theInstanceOrder, theInstances, theTolerance,
                 (mySliceText, mySize, myWinding) = mySlicePort
                 if mySliceText == "*MISSING TEXT*":
                     myPortStatus = "NO_TEXT"
-                if myType.startswith("COIL"):  # Coils check winding
+                if myIsCoil:  # Coils check winding
                     mySliceText += "@" + myWinding
                     if myConnectionCount == 0:
                         myPortWinding = myWinding
                     elif myPortWinding != myWinding:
                         myPortStatus = "WINDING"  # overrides "NO_TEXT"
-                elif myType.startswith("TSV"):  # TSV must be same shape
+                elif myIsTsv:  # TSV must be same shape
                     mySliceText += " " + mySize
                     if myPortSize == 0:
                         myPortSize = mySize
                     elif mySize != myPortSize:
                         myPortStatus = "SIZE"  # overrides "NO_TEXT"
-                myOutput += "," + mySliceText
+                myOutput.append(mySliceText)
                 myConnectionCount += 1
                 myPortInstanceSet.add(instance_it)
             else:  # No port on this chip
-                if myType.startswith("COIL"):  # Coils do not need ports on every chip
-                    myOutput += ", "
-                elif myType.startswith("TSV"):  # TSV must have port or blank on every chip
+                if myIsCoil:  # Coils do not need ports on every chip
+                    myOutput.append(" ")
+                elif myIsTsv:  # TSV must have port or blank on every chip
                     myBlankPortKey = HasBlankPort(instance_it, myType, myXY, theTolerance,
                                                   myBlankPorts, thePortData)
                     if myBlankPortKey:  # found blank port
                         (mySliceText, mySize, myWinding) = thePortData[myBlankPortKey]
                         myUsedBlankPorts.add(myBlankPortKey)
-                        myOutput += ", " + mySize
+                        myOutput.append(" " + mySize)
                         if myPortSize == 0:
                             myPortSize = mySize
                         elif mySize != myPortSize:
                             myPortStatus = "SIZE"  # overrides "NO_TEXT"
                     else:  # no matching port for this instance
-                        myOutput += ",?"
+                        myOutput.append("?")
                         myPortStatus = "NO_TSV"
                 else:  # dummy port
                     # test for use!
-                    myOutput += ", "
-        if myType.startswith("COIL"):  # Coil text must be unique
-            if myText in myUsedCoils or MultiplePorts(port_it, mySortedPorts, myPrintedPorts):
+                    myOutput.append(" ")
+        if myIsCoil:  # Coil text must be unique
+            if myText in myUsedCoils or (myTextCounts[myText] > 1 and MultiplePorts(
+                    port_it, mySortedPorts, myPrintedPorts)):
                 myPortStatus = "MULTI_TCI"
             myUsedCoils.add(myText)
             if myPortStatus == "OK" and myConnectionCount < 2:
                 # All TCI ports must have 2 or more connections
                 myPortStatus = "FLOATING"
-        elif myType.startswith("TSV"):  # Ports with same name must be connected on at least 1 slice
+        elif myIsTsv:  # Ports with same name must be connected on at least 1 slice
             if len(myNetInstanceSet) == 0:  # New net name
                 myNetInstanceSet = myPortInstanceSet.copy()
             elif myPortStatus == "OK":  # Same net with no errors yet
@@ -847,50 +1286,59 @@ def CheckPortData(thePortData, theInstanceOrder, theInstances, theTolerance,
                     for instance_it in myPortInstanceSet:
                         myNetInstanceSet.add(instance_it)
         myLastText = myText
-        theOutputFile.write(myPortStatus + "," + myOutput + "\n")
+        myOutputLines.append(myPortStatus + "," + ",".join(myOutput) + "\n")
     for portKey_it in thePortData:  # Check blank ports
         (myInstance, myXY, myType, myText) = portKey_it
         if myText == "" and portKey_it not in myUsedBlankPorts:
             myPortStatus = "BLANK"
             myPortSize = 0
-            (myX, myY) = literal_eval(myXY)
-            myOutput = "," + myType + "," + "{:.12g}, {:.12g}".format(myX, myY)
+            (myX, myY) = myXY
+            myOutput = ["", myType, "{:.12g}, {:.12g}".format(myX, myY)]
             for instance_it in theInstanceOrder:
                 myBlankPortKey = HasBlankPort(instance_it, myType, myXY, theTolerance,
                                               myBlankPorts, thePortData)
                 if myBlankPortKey:  # found blank port
                     (mySliceText, mySize, myWinding) = thePortData[myBlankPortKey]
                     myUsedBlankPorts.add(myBlankPortKey)
-                    myOutput += ", " + mySize
+                    myOutput.append(" " + mySize)
                     if myPortSize == 0:
                         myPortSize = mySize
                     elif mySize != myPortSize:
                         myPortStatus = "SIZE"  # overrides "BLANK"
                 else:  # no matching port for this instance
-                    myOutput += ",?"
+                    myOutput.append("?")
                     myPortStatus = "NO_TSV"  # overrides "BLANK"
-            theOutputFile.write(myPortStatus + "," + myOutput + "\n")
+            myOutputLines.append(myPortStatus + "," + ",".join(myOutput) + "\n")
+    theOutputFile.writelines(myOutputLines)
 
 def PrintUsage():
-    print("usage: stic.py [-t] sticXmlFile [outputFile]")
+    print("usage: stic.py [-t] [-j jobs] sticXmlFile [outputFile]")
     print("       -t: use text file for layout ports")
+    print("       -j: number of chips to load in parallel (default 1)")
 
 def main(argv):
     """Check the correspondence of stacked GDSII chip text
 
-    usage: stic.py sticXmlFile [outputFile]
+    usage: stic.py [-t] [-j jobs] sticXmlFile [outputFile]
     """
     DisplayLicense()
     try:
-        myOptions, argv = getopt.getopt(argv, "th", ["text", "help"])
+        myOptions, argv = getopt.getopt(argv, "thj:", ["text", "help", "jobs="])
     except getopt.GetoptError as myError:
         print(myError)
         PrintUsage()
         sys.exit(2)
     myUseText = False
+    myJobs = 1
     for myOption, myArg in myOptions:
         if myOption in ["-t", "--text"]:
             myUseText = True
+        elif myOption in ["-j", "--jobs"]:
+            if not myArg.isdigit() or int(myArg) < 1:
+                print("ERROR: invalid number of jobs " + myArg)
+                PrintUsage()
+                sys.exit(2)
+            myJobs = int(myArg)
         elif myOption in ["-h", "--help"]:
             PrintUsage()
             return
@@ -903,20 +1351,32 @@ def main(argv):
     myUserUnits = myStackedChip.find('userUnits').text
     myTolerance = float(myStackedChip.find('tolerance').text)
     (myInstances, myNetConnections) = ReadTopCdlFile(myStackedChip)
-    myPortData = {}  # {(instanceName, "(x, y)", portType, topNet): (portName, size, winding), ...}
-    for chip_it in myStackedChip.findall('chip'):
-        myPortData.update(PromoteChipPorts(chip_it, myInstances, myUserUnits, myUseText))
+    myPortData = {}  # {(instanceName, (x, y), portType, topNet): (portName, size, winding), ...}
+    myChipList = myStackedChip.findall('chip')
+    if myJobs > 1 and len(myChipList) > 1:  # Load chips in parallel, report in chip order.
+        myJobList = [(argv[0], index_it, myInstances, myUserUnits, myUseText)
+                     for index_it in range(len(myChipList))]
+        with ProcessPoolExecutor(max_workers=min(myJobs, len(myChipList))) as myExecutor:
+            for chip_it, result_it in zip(myChipList,
+                                          myExecutor.map(PromoteChipPortsJob, myJobList)):
+                (myChipPortData, mySource, myLog) = result_it
+                sys.stdout.write(myLog)
+                myInstances[GetChipSettings(chip_it)['instanceName']]['source'] = mySource
+                myPortData.update(myChipPortData)
+    else:
+        for chip_it in myChipList:
+            myPortData.update(PromoteChipPorts(chip_it, myInstances, myUserUnits, myUseText))
     if len(argv) == 2:
         print("Writing results to " + argv[1])
-        myOutputFile = open(argv[1], "w")
+        myOutputFile = open(argv[1], "w", buffering=1 << 20)
     else:
         myOutputFile = sys.stdout
-    mySortedInstances = []  # [instanceName, ...]
-    for instance_it in myStackedChip.findall('chip'):
-        mySortedInstances.append(instance_it.find('instanceName').text)
+    mySortedInstances = [chip_it.find('instanceName').text for chip_it in myChipList]
     PrintReportHeader(myOutputFile, mySortedInstances, myInstances)
     CheckPortData(myPortData, mySortedInstances, myInstances,
                   myTolerance, myOutputFile, myNetConnections)
+    if myOutputFile is not sys.stdout:
+        myOutputFile.close()
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -27,87 +27,91 @@ import sys
 import getopt
 import gzip
 import re
-import os
-import copy
-import xml.etree.ElementTree as ET
-from gdsii.library import Library
+import io
+try:
+    from lxml import etree as ET  # faster find/findall when installed
+except ImportError:
+    import xml.etree.ElementTree as ET
+from gdsii import exceptions, tags
 from gdsii.elements import *
 from gdsii.record import *
 import numpy as np
-from operator import attrgetter
-from pprint import pprint
-from ast import literal_eval
+try:
+    import gdstk  # faster uncompressed GDS reading when installed
+except ImportError:
+    gdstk = None
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 
 def OpenFile(theFileName, theMode="rt"):
     """Open a file (possibly compressed gz) and return file"""
     try:
-        if theFileName.endswith(".gz"):
+        if theFileName.endswith(".gz") and theMode == "rt":  # decompress in 128KB blocks
+            myFile = io.TextIOWrapper(io.BufferedReader(gzip.open(theFileName, mode="rb"),
+                                                        buffer_size=128 * 1024))
+        elif theFileName.endswith(".gz"):
             myFile = gzip.open(theFileName, mode=theMode)
         else:
-            myFile = open(theFileName, mode=theMode)
+            myFile = open(theFileName, mode=theMode, buffering=1 << 20)  # 1MB reads
     except IOError as myErrorDetail:
         print("ERROR: Could not open " + theFileName + " " + str(myErrorDetail.args))
         raise IOError
     return myFile
 
+MIRROR_BIT = 0x8000  # strans reflection bit
+ORIENTATIONS = {  # {(mirrored, angle): orientation, ...}
+    (False, 0): "R0", (False, 90): "R90", (False, 180): "R180", (False, 270): "R270",
+    (True, 0): "MX", (True, 90): "MXR90", (True, 180): "MY", (True, 270): "MYR90"}
+
 def GetOrientation(theElement):
     """Return a combined reflection/rotation orientation.
 
     R0, R90, R180, R270, MX, MXR90, MY, MYR90
     Doesn't handle magnification.
     """
-    if theElement.strans and (theElement.strans & int('1000000000000000', 2)):
-        if not theElement.angle: return "MX"
-        if theElement.angle == 90: return "MXR90"
-        if theElement.angle == 180: return "MY"
-        if theElement.angle == 270: return "MYR90" 
-    else:
-        if not theElement.angle: return "R0"
-        if theElement.angle == 90: return "R90"
-        if theElement.angle == 180: return "R180"
-        if theElement.angle == 270: return "R270"
-    print("ERROR: Invalid transform " + "{0:016b}".format(theElement.strans) + " in element")  
-    raise ValueError
+    myMirrored = bool(theElement.strans and theElement.strans & MIRROR_BIT)
+    myOrientation = ORIENTATIONS.get((myMirrored, theElement.angle or 0))
+    if myOrientation is None:
+        print("ERROR: Invalid transform " + "{0:016b}".format(theElement.strans or 0)
+              + " in element")
+        raise ValueError
+    return myOrientation
+
+ROTATIONS = {  # {orientation: rotation matrix, ...}
+    "R0": np.array([(1,0,0), (0,1,0), (0,0,1)], dtype=np.int64),
+    "R90": np.array([(0,1,0), (-1,0,0), (0,0,1)], dtype=np.int64),
+    "R180": np.array([(-1,0,0), (0,-1,0), (0,0,1)], dtype=np.int64),
+    "R270": np.array([(0,-1,0), (1,0,0), (0,0,1)], dtype=np.int64),
+    "MX": np.array([(1,0,0), (0,-1,0), (0,0,1)], dtype=np.int64),
+    "MXR90": np.array([(0,1,0), (1,0,0), (0,0,1)], dtype=np.int64),
+    "MY": np.array([(-1,0,0), (0,1,0), (0,0,1)], dtype=np.int64),
+    "MYR90": np.array([(0,-1,0), (-1,0,0), (0,0,1)], dtype=np.int64)}
+for rotation_it in ROTATIONS.values():
+    rotation_it.setflags(write=False)  # shared by all callers, copy before changing
 
 def GetTransform(theOrientation, theTranslation):
     """Return a transformation matrix for given orientation, translation.
 
     return: [(z0,y0,z0), (x1,y1,z1), (x2,y2,z2)] 
     """
-    if theOrientation == "R0":
-        myRotation = np.array([(1,0,0), (0,1,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "R90":
-        myRotation = np.array([(0,1,0), (-1,0,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "R180":
-        myRotation = np.array([(-1,0,0), (0,-1,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "R270":
-        myRotation = np.array([(0,-1,0), (1,0,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "MX":
-        myRotation = np.array([(1,0,0), (0,-1,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "MXR90":
-        myRotation = np.array([(0,1,0), (1,0,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "MY":
-        myRotation = np.array([(-1,0,0), (0,1,0), (0,0,1)], dtype=np.int64)
-    if theOrientation == "MYR90":
-        myRotation = np.array([(0,-1,0), (-1,0,0), (0,0,1)], dtype=np.int64)
-    myTranslation = np.array([(1,0,0), (0,1,0), (theTranslation[0][0],theTranslation[0][1],1)],
-                             dtype=np.int64)
-#    myScale = np.array([(float(theScale),0.,0.),(0.,float(theScale),0.),(0.,0.,1.)], dtype=np.float64)
-#    myTransform = np.dot(np.dot(myScale, myRotation), myTranslation)
-    myTransform = np.dot(myRotation, myTranslation)
+    if theOrientation not in ROTATIONS:
+        print("ERROR: Invalid orientation " + str(theOrientation))
+        raise ValueError
+    if theTranslation[0][0] == 0 and theTranslation[0][1] == 0:
+        return ROTATIONS[theOrientation]  # read only
+    # rotation x translation only replaces the last row of the rotation
+    myTransform = ROTATIONS[theOrientation].copy()
+    myTransform[2, :2] = theTranslation[0]
     return myTransform
 
 def Transform(thePointList, theTransform):
     """Returns a list of transformed points.
 
-    return: [(x,y), ...]
+    return: [[x,y], ...]
     """
-    myResult = []  # [(x,y), ...]
-    for point_it in thePointList:
-        myPoint = [point_it[0], point_it[1], 1]
-        myProduct = np.dot(myPoint, theTransform)
-        myResult.append((myProduct[0], myProduct[1]))
-    return myResult
+    myPoints = np.asarray(thePointList, dtype=np.int64).reshape(-1, 2)  # all points at once
+    return (np.dot(myPoints, theTransform[:2, :2]) + theTransform[2, :2]).tolist()
 
 def GetTextType(thePortText):
     """Return ("inputTextLayerNumber textType", "outputTextLayerNumber textType"). """
@@ -124,29 +128,34 @@ def GetTextType(thePortText):
 
 def PrintParameters(theStackedChip):
     """Print XML parameters."""
-    print("Top CDL " + theStackedChip.find('topCdlFile').text
-          + ", Top SUBCKT " + theStackedChip.find('topCell').text)
+    myLines = ["Top CDL " + theStackedChip.find('topCdlFile').text
+               + ", Top SUBCKT " + theStackedChip.find('topCell').text]
     chipCount = 0
     for chip_it in theStackedChip.findall('chip'):
         chipCount += 1
-        print("\nChip " + str(chipCount) + ":")
-        print(" CDL instance: " + chip_it.find('instanceName').text)
-        if chip_it.find('subcktName') is not None:
-            mySubcktName = chip_it.find('subcktName').text
+        myLines.append("\nChip " + str(chipCount) + ":")
+        myLines.append(" CDL instance: " + chip_it.find('instanceName').text)
+        mySubckt = chip_it.find('subcktName')
+        if mySubckt is not None:
+            mySubcktName = mySubckt.text
         else:
             mySubcktName = "look up in CDL"
-        print(" CDL file: " + chip_it.find('cdlFileName').text
-              + ", top block: " + mySubcktName)
-        print(" GDS file: " + chip_it.find('gdsFileName').text
-              + ", top block: " + chip_it.find('layoutName').text)
-        print(" Orientation: " + chip_it.find('orientation').text
-              + "; Offset: (" + chip_it.find('offset').find('x').text
-              + ", " + chip_it.find('offset').find('y').text + ")"
-              + "; Shrink: " + chip_it.find('shrink').text)
+        myLines.append(" CDL file: " + chip_it.find('cdlFileName').text
+                       + ", top block: " + mySubcktName)
+        myLines.append(" GDS file: " + chip_it.find('gdsFileName').text
+                       + ", top block: " + chip_it.find('layoutName').text)
+        myOffset = chip_it.find('offset')
+        myLines.append(" Orientation: " + chip_it.find('orientation').text
+                       + "; Offset: (" + myOffset.find('x').text
+                       + ", " + myOffset.find('y').text + ")"
+                       + "; Shrink: " + chip_it.find('shrink').text)
         for port_it in chip_it.findall('portText'):
             (myPortText, myOutputText) = GetTextType(port_it)
-            print(" Port text input: " + myPortText + "; output: " + myOutputText)
-            
+            myLines.append(" Port text input: " + myPortText + "; output: " + myOutputText)
+    sys.stdout.write("\n".join(myLines) + "\n")
+
+SUBCKT_START_RE = re.compile(r"^\.[sS][uU][bB][cC][kK][tT]\s+(\S+)")
+
 def ReadTopCdlFile(theStackedChip):
     """Read a CDL netlist and return a list of top instances with nets.
 
@@ -154,46 +163,42 @@ def ReadTopCdlFile(theStackedChip):
     """
     myTopCell = theStackedChip.find('topCell').text
     myTopCdlFile = theStackedChip.find('topCdlFile').text
-    mySubcktStartRE = re.compile("^\.[sS][uU][bB][cC][kK][tT]\s+(\S+)")
     print("Reading " + myTopCdlFile)
     myCdlFile = OpenFile(myTopCdlFile)
     mySaveInstances = False
-    myLine = ""
+    myLineParts = []  # [line, continuation, ...]
+    myKeepLine = False  # only continue lines that are used
     myInstances = {}  # {instanceName: {'master': masterName, 'nets': portList}, ...}
-    myUsedNets = set()
-    myNetConnections = set()
+    myNetCounts = Counter()  # {net: number of instances connected, ...}
     for line_it in myCdlFile:
-        if line_it.startswith("*"): continue  #ignore comments
-        if not line_it.strip(): continue  #ignore blank lines
-        if line_it.startswith("+"):
-            myLine += " " + line_it[1:]  # remove leading '+'
-        else:
-            if myLine:
-                if myLine.startswith("."):
-                    myMatch = mySubcktStartRE.search(myLine)
+        myFirstChar = line_it[:1]
+        if myFirstChar == "*": continue  #ignore comments
+        if myFirstChar == "+":
+            if myKeepLine:
+                myLineParts.append(line_it[1:])  # remove leading '+'
+        elif not line_it.isspace():  #ignore blank lines
+            if myLineParts:
+                myLine = " ".join(myLineParts)
+                myFirstChar = myLine[:1]
+                if myFirstChar == ".":
+                    myMatch = SUBCKT_START_RE.search(myLine)
                     if myMatch and myMatch.group(1) == myTopCell:
                         mySaveInstances = True
                     else:
                         mySaveInstances = False
-                if mySaveInstances and myLine.startswith("X"):
+                if mySaveInstances and myFirstChar == "X":
                     myWordList = myLine.split()
                     myInstances[myWordList[0]] = {'master': myWordList[-1],
                                                   'nets': myWordList[1:-1]}
-                    myInstanceNets = set()
-                    for net_it in myWordList[1:-1]:  # unique nets used in this instance
-                        if net_it not in myInstanceNets and net_it != "/":
-                            myInstanceNets.add(net_it)
-                    for net_it in myInstanceNets:
-                        if net_it in myUsedNets:  # 2 or more connections
-                            myNetConnections.add(net_it)
-                        else:  # first connections
-                            myUsedNets.add(net_it)
+                    myNetCounts.update(set(myWordList[1:-1]) - {"/"})  # unique nets used
                 elif not mySaveInstances and myInstances:  # finished top cell
                     break
-            myLine = line_it
+            myLineParts = [line_it]
+            myKeepLine = mySaveInstances or line_it[:1] == "."
     if not myInstances:
         print("ERROR: Could not find subckt " + myTopCell + " in " + myTopCdlFile)
         raise NameError
+    myNetConnections = {net_it for net_it, count_it in myNetCounts.items() if count_it > 1}
     return myInstances, myNetConnections
 
 def MapCdlPorts(theTopCell, theCdlFile, theParentNetList):
@@ -201,148 +206,325 @@ def MapCdlPorts(theTopCell, theCdlFile, theParentNetList):
 
     return: {portName: topNet, ...}
     """
-    mySubcktStartRE = re.compile("^\.[sS][uU][bB][cC][kK][tT]\s+(\S+)")
     print("\nReading " + theCdlFile)
     myCdlFile = OpenFile(theCdlFile)
-    mySaveInstances = False
-    myLine = ""
+    myLineParts = []  # [line, continuation, ...]
     myNetMap = {}  # {portName: topNet, ...}
     for line_it in myCdlFile:
-        if line_it.startswith("*"): continue  #ignore comments
-        if not line_it.strip(): continue  #ignore blank lines
-        if line_it.startswith("+"):
-            myLine += " " + line_it[1:]  # concatenate after removing leading '+'
-        else:
-            if myLine and myLine.startswith("."):
-                myMatch = mySubcktStartRE.search(myLine)
+        myFirstChar = line_it[:1]
+        if myFirstChar == "*": continue  #ignore comments
+        if myFirstChar == "+":
+            myLineParts.append(line_it[1:])  # concatenate after removing leading '+'
+        elif not line_it.isspace():  #ignore blank lines
+            if myLineParts and myLineParts[0][:1] == ".":  # join only statements
+                myLine = " ".join(myLineParts)
+                myMatch = SUBCKT_START_RE.search(myLine)
                 if myMatch and myMatch.group(1) == theTopCell:
                     myIndex = 0
                     for net_it in myLine.split()[2:]:
                         myNetMap[net_it] = theParentNetList[myIndex]
                         myIndex += 1
                     return myNetMap
-            myLine = line_it
+            myLineParts = [line_it]
     print("ERROR: could not find " + theTopCell + " in " + theCdlFile)
     raise NameError
 
-def CreateStructureIndex(theGdsiiLib):
-    """Return a dict of structure indices.
+GDS_ELEMENT_TAGS = {tags.BOUNDARY, tags.PATH, tags.SREF, tags.AREF, tags.TEXT, tags.NODE,
+                    tags.BOX}  # records that start an element
 
-    return: {structureName: structureObject, ...}
-    """
-    myStructureIndex = {}  # {structureName: structureObject, ...}
-    for structure_it in theGdsiiLib:
-        structure_it.processed = False
-        myStructureIndex[structure_it.name.decode('utf-8')] = structure_it
-    return myStructureIndex
-
-def LoadGdsText(theChip, theTopStructure):
-    """Return a list of text on the top structure.
+def LoadGdsStructureText(theGdsFile, theStructureName):
+    """Return the library units and the text elements of theStructureName from a GDS file.
 
-    return: [{'text': port, 'layer': layer type, 'xy': point}, ...]
+    Reads the file as a flat stream of gdsii records, keeping only the text records of
+    theStructureName, so other structures are never built into element objects.
+    return: (logical unit, [Text, ...]|None if theStructureName is missing)
+    """
+    myStructureName = theStructureName.encode('utf-8')
+    myLogicalUnit = None
+    myFoundTexts = None  # [Text, ...] of the last definition of theStructureName
+    myTexts = None  # [Text, ...] while reading theStructureName, else None
+    myElementTag = None
+    try:
+        for record_it in Record.iterate(theGdsFile):
+            myTag = record_it.tag
+            if myTag == tags.UNITS:
+                myLogicalUnit = record_it.data[0]
+            elif myTag == tags.STRNAME:
+                myTexts = [] if record_it.data == myStructureName else None
+                myElementTag = None
+            elif myTexts is None:
+                continue  # not in theStructureName
+            elif myTag in GDS_ELEMENT_TAGS:
+                myElementTag = myTag
+                (myLayer, myTextType, myXY, myString) = (None, None, None, None)
+            elif myElementTag != tags.TEXT:
+                if myTag == tags.ENDSTR:
+                    myFoundTexts = myTexts  # the last definition is used
+                    myTexts = None
+            elif myTag == tags.LAYER:
+                myLayer = record_it.data[0]
+            elif myTag == tags.TEXTTYPE:
+                myTextType = record_it.data[0]
+            elif myTag == tags.XY:
+                myXY = record_it.points
+            elif myTag == tags.STRING:
+                myString = record_it.data
+            elif myTag == tags.ENDEL:
+                myTexts.append(Text(myLayer, myTextType, myXY, myString))
+                myElementTag = None
+    except exceptions.FormatError as myError:
+        print("ERROR: Invalid GDS record reading " + theStructureName + ": "
+              + type(myError).__name__ + " " + str(myError))
+        raise
+    if myLogicalUnit is None:
+        print("ERROR: No UNITS record in GDS file for " + theStructureName)
+        raise ValueError
+    return (myLogicalUnit, myFoundTexts)
+
+TEXT_DTYPE = np.dtype([('text', object), ('layer', object), ('xy', np.int64, (2,))])
+
+def GetChipSettings(theChip):
+    """Return the chip settings read from the xml chip element.
+
+    return: {'instanceName': name, 'cdlFileName': file, 'subcktName': name|None,
+             'gdsFileName': file, 'layoutName': name, 'orientation': orientation,
+             'offset': (x, y), 'shrink': shrink,
+             'portTexts': [("inputLayer type", "outputLayer type"), ...]}
+    """
+    mySettings = {'portTexts': []}
+    for child_it in theChip:
+        if child_it.tag in mySettings:
+            continue  # the first element is used, as by find()
+        if child_it.tag in ('instanceName', 'cdlFileName', 'subcktName', 'gdsFileName',
+                            'layoutName', 'orientation'):
+            mySettings[child_it.tag] = child_it.text
+        elif child_it.tag == 'offset':
+            mySettings['offset'] = (float(child_it.find('x').text),
+                                    float(child_it.find('y').text))
+        elif child_it.tag == 'shrink':
+            mySettings['shrink'] = float(child_it.text)
+        elif child_it.tag == 'portText':
+            mySettings['portTexts'].append(GetTextType(child_it))
+    mySettings.setdefault('subcktName', None)
+    return mySettings
+
+def GetTextLayers(theSettings):
+    """Return the output layer type of each port text layer type of a chip.
+
+    return: {"layer type": "outputLayer type", ...}
     """
     myTextLayers = {}  # {layer type: outputLayerType, ...}
-    for port_it in theChip.findall('portText'):
-        (myPortText, myOutputText) = GetTextType(port_it)
+    for (myPortText, myOutputText) in theSettings['portTexts']:
         if myPortText != "no text":
             if myPortText not in myTextLayers:
                 myTextLayers[myPortText] = myOutputText
             else:
-                print("ERROR: Duplicate text definition in " + theChip.find('instanceName').text
+                print("ERROR: Duplicate text definition in " + theSettings['instanceName']
                       + " " + myPortText + " -> " + myTextLayers[myPortText]
                       + " and " + myOutputText)
                 raise ValueError
-    myTextList = []  # [{'text': text, 'layer': layer type, 'xy': [(x, y)]}, ...]
+    return myTextLayers
+
+def CreateTextTable(theTexts, theLayers, thePoints):
+    """Return a structured array (TEXT_DTYPE) from the text, layer and point lists."""
+    myTextTable = np.empty(len(theTexts), dtype=TEXT_DTYPE)
+    myTextTable['text'] = theTexts
+    myTextTable['layer'] = theLayers
+    if thePoints:
+        myTextTable['xy'] = thePoints
+    return myTextTable
+
+def LoadGdsText(theSettings, theTopStructure):
+    """Return a structured array of text on the top structure (TEXT_DTYPE).
+
+    return: array of (port, output layer type, (x, y))
+    """
+    myTextLayers = GetTextLayers(theSettings)
+    myLayerCache = {}  # {(layer, textType): outputLayerType or None, ...}
+    myTexts = []  # [text, ...]
+    myLayers = []  # [output layer type, ...]
+    myPoints = []  # [(x, y), ...]
     for element_it in theTopStructure:
-        if element_it.__class__.__name__ == 'Text':
-            myLayerType = str(element_it.layer) + " " + str(element_it.text_type)
-            if myLayerType in myTextLayers:
-                myTextList.append({'text': element_it.string.decode('utf-8'),
-                                   'layer': myTextLayers[myLayerType],
-                                   'xy': element_it.xy})
-    return myTextList
-
-def UserScale(thePoint, theScale):
-    """Returns thePoint scaled to used coordinates"""
-    myX = thePoint[0][0] / theScale
-    myY = thePoint[0][1] / theScale
-    return("{0:.12g} {1:.12g}".format(myX, myY))
-
-def TranslateChipPorts(thePortList, theOrientation, theTranslation, theScale):
+        if type(element_it) is Text:
+            myLayerKey = (element_it.layer, element_it.text_type)
+            if myLayerKey in myLayerCache:
+                myOutputLayer = myLayerCache[myLayerKey]
+            else:  # format each layer type once
+                myOutputLayer = myTextLayers.get(str(myLayerKey[0]) + " " + str(myLayerKey[1]))
+                myLayerCache[myLayerKey] = myOutputLayer
+            if myOutputLayer is not None:
+                myTexts.append(element_it.string.decode())  # utf-8
+                myLayers.append(myOutputLayer)
+                myPoints.append(element_it.xy[0])
+    return CreateTextTable(myTexts, myLayers, myPoints)
+
+def LoadGdstkText(theSettings, theGdsFileName, theLayoutName):
+    """Read the text on theLayoutName of an uncompressed GDS file with gdstk.
+
+    gdstk reads every cell, but with an empty shape filter only labels and references are
+    built, like LoadGdsStructureText which keeps only text records.
+    return: (database units per user unit, TEXT_DTYPE array or None if theLayoutName is missing)
+    """
+    (myUnit, myPrecision) = gdstk.gds_units(theGdsFileName)
+    myLibrary = gdstk.read_gds(theGdsFileName, unit=myPrecision,  # coordinates in database units
+                               filter=set())  # no polygons or paths
+    myInternalDbuPerUU = 1 / (myPrecision / myUnit)  # as 1 / logical_unit
+    myTopCell = None
+    for cell_it in myLibrary.cells:
+        if cell_it.name == theLayoutName:
+            myTopCell = cell_it  # the last definition is used
+    if myTopCell is None:
+        return (myInternalDbuPerUU, None)
+    myTextLayers = GetTextLayers(theSettings)
+    myLayerCache = {}  # {(layer, textType): outputLayerType or None, ...}
+    myTexts = []  # [text, ...]
+    myLayers = []  # [output layer type, ...]
+    myPoints = []  # [(x, y), ...]
+    for label_it in myTopCell.labels:  # text on the top cell only
+        myLayerKey = (label_it.layer, label_it.texttype)
+        if myLayerKey in myLayerCache:
+            myOutputLayer = myLayerCache[myLayerKey]
+        else:  # format each layer type once
+            myOutputLayer = myTextLayers.get(str(myLayerKey[0]) + " " + str(myLayerKey[1]))
+            myLayerCache[myLayerKey] = myOutputLayer
+        if myOutputLayer is not None:
+            myTexts.append(label_it.text)
+            myLayers.append(myOutputLayer)
+            myPoints.append((round(label_it.origin[0]), round(label_it.origin[1])))
+    return (myInternalDbuPerUU, CreateTextTable(myTexts, myLayers, myPoints))
+
+def UserScaleList(thePoints, theScale):
+    """Returns each of thePoints scaled to user coordinates, dividing all points at once.
+
+    return: ["x y", ...]
+    """
+    myPoints = (np.array(thePoints, dtype=np.float64).reshape(-1, 2) / theScale).tolist()
+    # %-format is faster than .format with the same .12g output
+    return ["%.12g %.12g" % (x_it, y_it) for x_it, y_it in myPoints]
+
+def TranslateChipPorts(theTextTable, theOrientation, theTranslation, theScale):
     """Return a list of ports and transformed to final position in user units.
-    return: [{'text': portName, 'xy': position}, ...]
+    return: [(portName, layer type, "x y"), ...]
     """
-    myInstancePortList = []
-    # [{'text': port, 'xy': "(x, y)"}, ...]
     myTransform = GetTransform(theOrientation, theTranslation)
-    for port_it in thePortList:
-        myInstancePortList.append({'text': port_it['text'],
-                                   'layer': port_it['layer'],
-                                   'xy': UserScale(Transform(port_it['xy'], myTransform),
-                                                   theScale)})
-    return myInstancePortList
-
-def GetGdsPortData(theChip):
+    myXYList = UserScaleList(Transform(theTextTable['xy'], myTransform),
+                             theScale)  # all ports at once
+    return list(zip(theTextTable['text'].tolist(), theTextTable['layer'].tolist(), myXYList))
+
+def GetGdsPortData(theSettings):
     """Translate GDS port data to final positions.
 
-    return: [{'text': port, 'xy': "(x, y)"}, ...]
+    return: [(port, layer type, "x y"), ...]
     Note: x, y in user units.
     """
-    myLayoutName = theChip.find('layoutName').text
-    myGdsFileName = theChip.find('gdsFileName').text
-    myOrientation = theChip.find('orientation').text
-    myShrink = float(theChip.find('shrink').text)
+    myLayoutName = theSettings['layoutName']
+    myGdsFileName = theSettings['gdsFileName']
     print("Reading " + myGdsFileName)
-    myGdsFile = OpenFile(myGdsFileName, "rb")
-    myGdsiiLib = Library.load(myGdsFile)
-    myInternalDbuPerUU = 1 / myGdsiiLib.logical_unit
-    myOffset = theChip.find('offset')
-    myX = float(myOffset.find('x').text) * myInternalDbuPerUU
-    myY = float(myOffset.find('y').text) * myInternalDbuPerUU
-    myStructureIndex = CreateStructureIndex(myGdsiiLib)
+    myUseGdstk = gdstk is not None and not myGdsFileName.endswith(".gz")
+    if myUseGdstk:
+        (myInternalDbuPerUU, myTextTable) = LoadGdstkText(theSettings, myGdsFileName, myLayoutName)
+        myTopStructure = myTextTable  # None if not found
+    else:
+        myGdsFile = OpenFile(myGdsFileName, "rb")
+        (myLogicalUnit, myTopStructure) = LoadGdsStructureText(myGdsFile, myLayoutName)
+        myGdsFile.close()
+        myInternalDbuPerUU = 1 / myLogicalUnit
+    myX = theSettings['offset'][0] * myInternalDbuPerUU
+    myY = theSettings['offset'][1] * myInternalDbuPerUU
     print("Loading ports...")
-    if myLayoutName not in myStructureIndex:
+    if myTopStructure is None:
         print("ERROR: Could not find " + myLayoutName + " in " + myGdsFileName)
         raise NameError
-    myTextList = LoadGdsText(theChip, myStructureIndex[myLayoutName])
+    if not myUseGdstk:
+        myTextTable = LoadGdsText(theSettings, myTopStructure)
     print("Assigning text...")
-    return TranslateChipPorts(myTextList, myOrientation, [(myX, myY)],
-                              myInternalDbuPerUU / myShrink)
+    return TranslateChipPorts(myTextTable, theSettings['orientation'], [(myX, myY)],
+                              myInternalDbuPerUU / theSettings['shrink'])
 
 def PrintChipPorts(theChip, theInstances, theNetConnections, theOutputFile):
     """Print individual chip text at top level."""
-    myInstanceName = theChip.find('instanceName').text
-    myCdlFile = theChip.find('cdlFileName').text
-    if theChip.find('subcktName') is None:
+    mySettings = GetChipSettings(theChip)  # read the chip element once
+    myInstanceName = mySettings['instanceName']
+    myCdlFile = mySettings['cdlFileName']
+    if mySettings['subcktName'] is None:
         myMasterSubckt = theInstances[myInstanceName]['master']
     else:
-        myMasterSubckt = theChip.find('subcktName').text
+        myMasterSubckt = mySettings['subcktName']
+    myLayoutName = mySettings['layoutName']  # for warnings
+    myGdsFileName = mySettings['gdsFileName']
     myCdlPortMap = MapCdlPorts(myMasterSubckt, myCdlFile, theInstances[myInstanceName]['nets'])
-    myGdsPortData = GetGdsPortData(theChip)
+    myGdsPortData = GetGdsPortData(mySettings)
     myPrintedPorts = set()  # {localNet, ...}
-    for port_it in myGdsPortData:
-        if port_it['text'] in myCdlPortMap:
-            theOutputFile.write(" ".join(("LAYOUT TEXT",
-                                          "\"" + myCdlPortMap[port_it['text']] + "\"",
-                                          port_it['xy'], port_it['layer'], "\n")))
-            myPrintedPorts.add(port_it['text'])     
+    myOutputLines = []  # ["LAYOUT TEXT ...\n", ...] not yet written
+    for (myText, myLayer, myXY) in myGdsPortData:
+        if myText in myCdlPortMap:
+            myOutputLines.append(" ".join(("LAYOUT TEXT", "\"" + myCdlPortMap[myText] + "\"",
+                                           myXY, myLayer, "\n")))
+            myPrintedPorts.add(myText)
         else:
-            print("WARNING: layout port " + port_it['text']
-                  + " at (" + port_it['xy'] + ") of " + theChip.find('layoutName').text
-                  + " in " + theChip.find('gdsFileName').text
+            theOutputFile.write("".join(myOutputLines))  # keep order when output is stdout
+            myOutputLines = []
+            print("WARNING: layout port " + myText
+                  + " at (" + myXY + ") of " + myLayoutName
+                  + " in " + myGdsFileName
                   + " not in subckt " + myInstanceName + "(" + myMasterSubckt + ") of " + myCdlFile)
-    for net_it in myCdlPortMap:  # Check for CDL nets missing ports
-        if net_it not in myPrintedPorts:
-            print("WARNING: net " + net_it + " of " + myInstanceName + "(" + myMasterSubckt + ") of "
-                  + myCdlFile + " has no layout text")
+    theOutputFile.write("".join(myOutputLines))
+    myMissingNets = myCdlPortMap.keys() - myPrintedPorts  # CDL nets missing ports, usually none
+    if myMissingNets:
+        for net_it in myCdlPortMap:  # warn in CDL order
+            if net_it in myMissingNets:
+                print("WARNING: net " + net_it + " of " + myInstanceName + "(" + myMasterSubckt
+                      + ") of " + myCdlFile + " has no layout text")
+
+def PrintChipPortsJob(theJob):
+    """Print the text of one chip in a worker process.
+
+    theJob: (xmlFileName, chipIndex, instances, netConnections, outputIsStdout)
+    return: (output text, captured log)
+    When the output is stdout, output and log share one buffer to keep their order.
+    """
+    (myXmlFileName, myChipIndex, myInstances, myNetConnections, myOutputIsStdout) = theJob
+    myChip = ET.parse(myXmlFileName).getroot().findall('chip')[myChipIndex]
+    myLog = io.StringIO()
+    myOutput = myLog if myOutputIsStdout else io.StringIO()
+    try:
+        with redirect_stdout(myLog):
+            PrintChipPorts(myChip, myInstances, myNetConnections, myOutput)
+    except:
+        sys.stdout.write(myLog.getvalue())
+        raise
+    if myOutputIsStdout:
+        return ("", myLog.getvalue())
+    return (myOutput.getvalue(), myLog.getvalue())
+
+def PrintUsage():
+    print("usage: stic_text.py [-j jobs] sticTextXmlFile [outputFile]")
+    print("       -j: number of chips to read in parallel (default 1)")
 
 def main(argv):
     """Output a list of text for top level Calibre LVS
 
-    usage: stic_text.py sticTextXmlFile [outputFile]
+    usage: stic_text.py [-j jobs] sticTextXmlFile [outputFile]
     """
+    try:
+        myOptions, argv = getopt.getopt(argv, "hj:", ["help", "jobs="])
+    except getopt.GetoptError as myError:
+        print(myError)
+        PrintUsage()
+        sys.exit(2)
+    myJobs = 1
+    for myOption, myArg in myOptions:
+        if myOption in ["-j", "--jobs"]:
+            if not myArg.isdigit() or int(myArg) < 1:
+                print("ERROR: invalid number of jobs " + myArg)
+                PrintUsage()
+                sys.exit(2)
+            myJobs = int(myArg)
+        elif myOption in ["-h", "--help"]:
+            PrintUsage()
+            return
     if not (1 <= len(argv) <= 2):
-        print("usage: stic_text.py sticTextXmlFile [outputFile]")
+        PrintUsage()
         return
     print("STIC: Stacked Terminal Interconnect Check Text version 0.09.00")
     print("Reading settings...")
@@ -351,11 +533,22 @@ def main(argv):
     (myInstances, myNetConnections) = ReadTopCdlFile(myStackedChip)
     if len(argv) == 2:
         print("Writing results to " + argv[1])
-        myOutputFile = open(argv[1], "w")
+        myOutputFile = open(argv[1], "w", buffering=1 << 20)
     else:
         myOutputFile = sys.stdout
-    for chip_it in myStackedChip.findall('chip'):
-        PrintChipPorts(chip_it, myInstances, myNetConnections, myOutputFile)
+    myChipList = myStackedChip.findall('chip')
+    if myJobs > 1 and len(myChipList) > 1:  # Read chips in parallel, write in chip order.
+        myJobList = [(argv[0], index_it, myInstances, myNetConnections,
+                      myOutputFile is sys.stdout) for index_it in range(len(myChipList))]
+        with ProcessPoolExecutor(max_workers=min(myJobs, len(myChipList))) as myExecutor:
+            for (myOutput, myLog) in myExecutor.map(PrintChipPortsJob, myJobList):
+                sys.stdout.write(myLog)
+                myOutputFile.write(myOutput)
+    else:
+        for chip_it in myChipList:
+            PrintChipPorts(chip_it, myInstances, myNetConnections, myOutputFile)
+    if myOutputFile is not sys.stdout:
+        myOutputFile.close()
 
 if __name__ == '__main__':
     main(sys.argv[1:])
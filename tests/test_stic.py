@@ -0,0 +1,277 @@
+"""Regression tests for stic.py."""
+
+import contextlib
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from gdsii.elements import Boundary, SRef, Text
+from gdsii.library import Library
+from gdsii.structure import Structure
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import stic  # noqa: E402
+
+XML_TEMPLATE = """<?xml version="1.0"?>
+<stackedChip>
+ <topCell>TOP</topCell>
+ <topCdlFile>top.cdl</topCdlFile>
+ <userUnits>um</userUnits>
+ <tolerance>0.01</tolerance>
+ <chip>
+  <instanceName>XA</instanceName>
+  <cdlFileName>chip.cdl</cdlFileName>
+  <layoutName>CHIP</layoutName>
+  <gdsFileName>chip.gds</gdsFileName>
+  <portFile>ports.json</portFile>
+  <orientation>{orientation}</orientation>
+  <offset><x>0</x><y>0</y></offset>
+  <shrink>1.0</shrink>
+  <port><type>TSV</type><layerNumber>10</layerNumber><dataType>0</dataType>
+   <portText><layerNumber>11</layerNumber><textType>0</textType></portText>
+   <portCell>TSV</portCell></port>
+ </chip>
+</stackedChip>
+"""
+
+def WriteRectangularTsvChip(theDirectory, theOrientation):
+    """Write a one chip design with a 6um wide, 4um high TSV port named P1."""
+    myLibrary = Library(5, b'LIB', 1e-9, 1e-3)  # 1000 database units per um
+    myTsv = Structure(b'TSV')
+    myTsv.append(Boundary(10, 0, [(-3000, -2000), (3000, -2000), (3000, 2000),
+                                  (-3000, 2000), (-3000, -2000)]))
+    myLibrary.append(myTsv)
+    myChip = Structure(b'CHIP')
+    myChip.append(SRef(b'TSV', [(0, 0)]))
+    myChip.append(Text(11, 0, [(0, 0)], b'P1'))
+    myLibrary.append(myChip)
+    with open(os.path.join(theDirectory, "chip.gds"), "wb") as myGdsFile:
+        myLibrary.save(myGdsFile)
+    with open(os.path.join(theDirectory, "top.cdl"), "w") as myCdlFile:
+        myCdlFile.write(".SUBCKT TOP N1\nXA N1 CHIP\n.ENDS\n")
+    with open(os.path.join(theDirectory, "chip.cdl"), "w") as myCdlFile:
+        myCdlFile.write(".SUBCKT CHIP P1\n.ENDS\n")
+    with open(os.path.join(theDirectory, "stic.xml"), "w") as myXmlFile:
+        myXmlFile.write(XML_TEMPLATE.format(orientation=theOrientation))
+
+class RotatedChipSizeTest(unittest.TestCase):
+
+    def RunChip(self, theOrientation):
+        """Run stic.py on the rectangular TSV chip and return (csv size, port file size)."""
+        myCurrentDirectory = os.getcwd()
+        with tempfile.TemporaryDirectory() as myDirectory:
+            WriteRectangularTsvChip(myDirectory, theOrientation)
+            os.chdir(myDirectory)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stic.main(["stic.xml", "out.csv"])
+                with open("out.csv") as myCsvFile:
+                    myRows = [row_it for row_it in csv.reader(myCsvFile) if row_it[1] == "N1"]
+                with open("ports.json") as myPortFile:
+                    myPorts = json.load(myPortFile)
+            finally:
+                os.chdir(myCurrentDirectory)
+        self.assertEqual(len(myRows), 1)
+        self.assertEqual(len(myPorts), 1)
+        return (myRows[0][-1], myPorts[0]['size'])
+
+    def test_unrotated_size(self):
+        for orientation_it in ["R0", "R180", "MX", "MY"]:
+            with self.subTest(orientation=orientation_it):
+                self.assertEqual(self.RunChip(orientation_it), ("P1 (6x4)", "(6x4)"))
+
+    def test_rotated_size_is_swapped(self):
+        for orientation_it in ["R90", "R270", "MXR90", "MYR90"]:
+            with self.subTest(orientation=orientation_it):
+                self.assertEqual(self.RunChip(orientation_it), ("P1 (4x6)", "(4x6)"))
+
+@unittest.skipIf(not (shutil.which("pigz") or shutil.which("gzip")), "no pigz or gzip")
+class DecompressionPipeTest(unittest.TestCase):
+
+    def WriteGzipFile(self, theDirectory, theTruncate):
+        """Write a .gz CDL file, cut in the middle of the compressed data if theTruncate."""
+        myData = gzip.compress(("".join("M%d a b c d nch\n" % index_it
+                                         for index_it in range(20000))).encode())
+        myFileName = os.path.join(theDirectory, "chip.cdl.gz")
+        with open(myFileName, "wb") as myFile:
+            myFile.write(myData[:len(myData) // 2] if theTruncate else myData)
+        return myFileName
+
+    def test_complete_file_is_reaped(self):
+        with tempfile.TemporaryDirectory() as myDirectory:
+            myFile = stic.OpenFile(self.WriteGzipFile(myDirectory, False), "rb")
+            myFile.read(100)  # stop before the end, as Library.load stops at ENDLIB
+            stic.CloseFile(myFile)
+        self.assertEqual(myFile.process.returncode, 0)
+
+    def test_stopped_early_is_reaped(self):
+        with tempfile.TemporaryDirectory() as myDirectory:
+            myFile = stic.OpenFile(self.WriteGzipFile(myDirectory, False))
+            next(myFile)
+            stic.CloseFile(myFile, True)
+        self.assertIsNotNone(myFile.process.returncode)
+
+    def test_truncated_file_is_an_error(self):
+        with tempfile.TemporaryDirectory() as myDirectory:
+            myFile = stic.OpenFile(self.WriteGzipFile(myDirectory, True))
+            for line_it in myFile:
+                pass
+            with contextlib.redirect_stdout(io.StringIO()) as myLog:
+                with self.assertRaises(IOError):
+                    stic.CloseFile(myFile)
+        self.assertIn("ERROR: Could not decompress", myLog.getvalue())
+
+SUBCKT_CDL = """* header comment
+.SUBCKT CHIP A B
++ C
+* comment inside a continuation
+
++ D
+X1 A B SUB
+X2 C D SUB .subckt MIDLINE P
+*.subckt COMMENTED P
+.ENDS
+.subckt SUB P Q
+M1 P Q P P nch
+.ends
+.SUBCKT CHIP DUPLICATE
+.ENDS
+.subckt LAST X Y
++ Z
+"""
+
+class CdlSubcktPortsTest(unittest.TestCase):
+
+    def ReadBothPaths(self, theText):
+        """Return the subckt ports read with mmap (.cdl) and line by line (.cdl.gz)."""
+        with tempfile.TemporaryDirectory() as myDirectory:
+            myCdlFileName = os.path.join(myDirectory, "chip.cdl")
+            with open(myCdlFileName, "wb") as myFile:
+                myFile.write(theText.encode())
+            with gzip.open(myCdlFileName + ".gz", "wb") as myFile:
+                myFile.write(theText.encode())
+            return (stic.ReadCdlSubcktPorts(myCdlFileName),
+                    stic.ReadCdlSubcktPorts(myCdlFileName + ".gz"))
+
+    def test_mmap_and_text_paths_match(self):
+        for newline_it in ["\n", "\r\n"]:
+            with self.subTest(newline=repr(newline_it)):
+                (myMmapPorts, myTextPorts) = self.ReadBothPaths(
+                    SUBCKT_CDL.replace("\n", newline_it))
+                self.assertEqual(myMmapPorts, {"CHIP": ["A", "B", "C", "D"], "SUB": ["P", "Q"],
+                                               "LAST": ["X", "Y", "Z"]})
+                # A .subckt as the last statement is not ended by a following line, so the
+                # text path drops it.
+                del myMmapPorts["LAST"]
+                self.assertEqual(myTextPorts, myMmapPorts)
+
+def IsWithinTolerance(theDistance, theTolerance):
+    """The original tolerance rule that GetToleranceLimit replaces."""
+    return round(theDistance / theTolerance * 100000) <= 100000
+
+class ToleranceLimitTest(unittest.TestCase):
+
+    def test_limit_boundary(self):
+        for tolerance_it in [0.01, 0.001, 0.005, 0.1, 1.0, 2.5, 1e-7, 1234.5]:
+            with self.subTest(tolerance=tolerance_it):
+                myLimit = stic.GetToleranceLimit(tolerance_it)
+                self.assertTrue(IsWithinTolerance(myLimit, tolerance_it))
+                self.assertFalse(IsWithinTolerance(math.nextafter(myLimit, math.inf),
+                                                   tolerance_it))
+                self.assertTrue(IsWithinTolerance(math.nextafter(myLimit, 0), tolerance_it))
+                self.assertTrue(IsWithinTolerance(tolerance_it, tolerance_it))
+                self.assertGreaterEqual(myLimit, tolerance_it)
+
+    def test_zero_tolerance_is_an_error(self):
+        with contextlib.redirect_stdout(io.StringIO()) as myLog:
+            with self.assertRaises(ValueError):
+                stic.GetToleranceLimit(0.0)
+        self.assertIn("ERROR:", myLog.getvalue())
+
+    def test_negative_and_infinite_tolerance(self):
+        for tolerance_it in [-0.01, -math.inf, math.inf]:
+            with self.subTest(tolerance=tolerance_it):
+                self.assertEqual(stic.GetToleranceLimit(tolerance_it), math.inf)
+
+def BaselineXyList(thePortIndex, theSortedPorts, theTolerance):
+    """The original per-pair scan that CreateXyList replaces."""
+    (myText, myType, myXY) = theSortedPorts[thePortIndex]
+    myXyList = [myXY]
+    for nextPort_it in range(thePortIndex+1, len(theSortedPorts)):
+        (myNextText, myNextType, myNextXY) = theSortedPorts[nextPort_it]
+        if not (myNextText == myText and myNextType == myType): break
+        if not IsWithinTolerance(abs(myNextXY[0] - myXY[0]), theTolerance): break
+        if IsWithinTolerance(abs(myNextXY[1] - myXY[1]), theTolerance):
+            myXyList.append(myNextXY)
+    return myXyList
+
+class CreateXyListTest(unittest.TestCase):
+
+    def assertMatchesBaseline(self, thePorts, theTolerance):
+        mySortedPorts = sorted(thePorts, key=stic.CreateSortKey)
+        myXyIndex = stic.CreateXyIndex(mySortedPorts)
+        for port_it in range(len(mySortedPorts)):
+            with self.subTest(port=mySortedPorts[port_it]):
+                self.assertEqual(stic.CreateXyList(port_it, mySortedPorts, theTolerance, myXyIndex),
+                                 BaselineXyList(port_it, mySortedPorts, theTolerance))
+        return (mySortedPorts, myXyIndex)
+
+    def test_more_than_64_ports_in_x_window(self):
+        myRandom = random.Random(1)
+        myPorts = set()
+        for port_it in range(300):
+            myX = round(myRandom.uniform(0, 0.02), 6)
+            myY = myRandom.choice([0.0, 0.01, 0.02, 0.5]) + round(myRandom.uniform(0, 0.01), 6)
+            myPorts.add(("VDD", "M1", (myX, myY)))
+        myPorts.update({("VDD", "M1", (0.01, 0.0)), ("VDD", "M1", (0.02, 0.01))})  # at tolerance
+        (mySortedPorts, myXyIndex) = self.assertMatchesBaseline(myPorts, 0.01)
+        myLongest = max(len(stic.CreateXyList(port_it, mySortedPorts, 0.01, myXyIndex))
+                        for port_it in range(len(mySortedPorts)))
+        self.assertGreater(myLongest, 64)
+
+    def test_x_not_ascending_after_rounding(self):
+        # x values that round to the same sort key are ordered by y, not by x.
+        myPorts = [("A", "M1", (1.000004, 0.0)), ("A", "M1", (1.000001, 0.005)),
+                   ("A", "M1", (1.000003, 0.01)), ("A", "M1", (1.000002, 0.02)),
+                   ("A", "M1", (1.011, 0.0)), ("A", "M1", (1.0111, 0.0))]
+        (mySortedPorts, myXyIndex) = self.assertMatchesBaseline(myPorts, 0.01)
+        self.assertFalse(myXyIndex[3][0])
+
+    def test_run_ends_at_text_or_type_change(self):
+        myPorts = [("A", "M1", (0.0, 0.0)), ("A", "M1", (0.004, 0.004)),
+                   ("A", "M2", (0.0, 0.0)), ("A", "M2", (0.002, 0.0)),
+                   ("B", "M1", (0.0, 0.0)), ("B", "M1", (0.001, 0.001)),
+                   ("C", "M1", (0.0, 0.0))]
+        (mySortedPorts, myXyIndex) = self.assertMatchesBaseline(myPorts, 0.01)
+        # The sort key has no type, so the A M1 run at (0, 0) ends at the A M2 port.
+        self.assertEqual(mySortedPorts[1], ("A", "M2", (0.0, 0.0)))
+        self.assertEqual(stic.CreateXyList(0, mySortedPorts, 0.01, myXyIndex), [(0.0, 0.0)])
+        self.assertEqual(stic.CreateXyList(1, mySortedPorts, 0.01, myXyIndex),
+                         [(0.0, 0.0), (0.002, 0.0)])
+
+DUPLICATED_CHIP_XML = ("<chip><instanceName>XA</instanceName><instanceName>XB</instanceName>"
+    "<cdlFileName>a.cdl</cdlFileName><gdsFileName>a.gds</gdsFileName>"
+    "<layoutName>A</layoutName><layoutName>B</layoutName>"
+    "<orientation>R0</orientation><orientation>R90</orientation>"
+    "<offset><x>1</x><y>2</y></offset><offset><x>3</x><y>4</y></offset>"
+    "<shrink>1.0</shrink><shrink>0.5</shrink></chip>")
+
+class ChipSettingsTest(unittest.TestCase):
+
+    def test_first_duplicate_element_is_used(self):
+        mySettings = stic.GetChipSettings(ET.fromstring(DUPLICATED_CHIP_XML))
+        self.assertEqual((mySettings['instanceName'], mySettings['layoutName'],
+                          mySettings['orientation'], mySettings['offset'], mySettings['shrink']),
+                         ("XA", "A", "R0", (1.0, 2.0), 1.0))
+
+if __name__ == '__main__':
+    unittest.main()
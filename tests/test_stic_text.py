@@ -0,0 +1,107 @@
+"""Regression tests for stic_text.py."""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from gdsii import exceptions
+from gdsii.elements import Boundary, SRef, Text
+from gdsii.library import Library
+from gdsii.structure import Structure
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import stic_text  # noqa: E402
+
+try:
+    import gdstk
+except ImportError:
+    gdstk = None
+
+def CreateMultiStructureGds(theUnits=(1e-9, 1e-3)):
+    """Return GDS bytes with text in the TOP structure and in the structures around it."""
+    myLibrary = Library(5, b'LIB', theUnits[0], theUnits[1])
+    myBefore = Structure(b'BEFORE')
+    myBefore.append(Text(11, 0, [(1, 1)], b'BEFORE_TEXT'))
+    myBefore.append(Boundary(10, 0, [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]))
+    myLibrary.append(myBefore)
+    myTop = Structure(b'TOP')
+    myTop.append(SRef(b'BEFORE', [(100, 200)]))
+    myTop.append(Text(11, 0, [(10, 20)], b'TOP_A'))
+    myTop.append(Boundary(10, 0, [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]))
+    myTop.append(Text(21, 5, [(-30, 40)], b'TOP_B'))
+    myLibrary.append(myTop)
+    myAfter = Structure(b'AFTER')
+    myAfter.append(Text(11, 0, [(2, 2)], b'AFTER_TEXT'))
+    myLibrary.append(myAfter)
+    myStream = io.BytesIO()
+    myLibrary.save(myStream)
+    return myStream.getvalue()
+
+class LoadGdsStructureTextTest(unittest.TestCase):
+
+    def test_only_top_structure_text(self):
+        (myLogicalUnit, myTexts) = stic_text.LoadGdsStructureText(
+            io.BytesIO(CreateMultiStructureGds()), "TOP")
+        self.assertEqual(myLogicalUnit, 1e-3)
+        self.assertEqual([(text_it.string, text_it.layer, text_it.text_type, text_it.xy)
+                          for text_it in myTexts],
+                         [(b'TOP_A', 11, 0, [(10, 20)]), (b'TOP_B', 21, 5, [(-30, 40)])])
+
+    def test_missing_structure(self):
+        (myLogicalUnit, myTexts) = stic_text.LoadGdsStructureText(
+            io.BytesIO(CreateMultiStructureGds()), "NOPE")
+        self.assertIsNone(myTexts)
+
+    def test_record_size_below_header_is_rejected(self):
+        myGds = CreateMultiStructureGds()
+        myName = b'\x00\x0a\x06\x06AFTER\x00'  # STRNAME record of a skipped structure
+        myIndex = myGds.index(myName) + len(myName)
+        myBadGds = myGds[:myIndex] + b'\x00\x00\x08\x00' + myGds[myIndex:]  # 0 byte TEXT
+        with contextlib.redirect_stdout(io.StringIO()) as myLog:
+            with self.assertRaises(exceptions.IncorrectDataSize):
+                stic_text.LoadGdsStructureText(io.BytesIO(myBadGds), "TOP")
+        self.assertIn("ERROR: Invalid GDS record", myLog.getvalue())
+
+@unittest.skipIf(gdstk is None, "gdstk is not installed")
+class LoadGdstkTextTest(unittest.TestCase):
+
+    def test_matches_gdsii_reader(self):
+        mySettings = {'instanceName': 'XA',
+                      'portTexts': [("11 0", "111 5"), ("21 5", "21 5"), ("30 0", "no text")]}
+        for units_it in [(1e-9, 1e-3), (1e-10, 1e-4)]:
+            with self.subTest(units=units_it), tempfile.TemporaryDirectory() as myDirectory:
+                myGdsFileName = os.path.join(myDirectory, "multi.gds")
+                with open(myGdsFileName, "wb") as myGdsFile:
+                    myGdsFile.write(CreateMultiStructureGds(units_it))
+                with open(myGdsFileName, "rb") as myGdsFile:
+                    (myLogicalUnit, myTexts) = stic_text.LoadGdsStructureText(myGdsFile, "TOP")
+                myExpected = stic_text.LoadGdsText(mySettings, myTexts)
+                (myDbuPerUU, myTextTable) = stic_text.LoadGdstkText(mySettings, myGdsFileName,
+                                                                    "TOP")
+                self.assertEqual(myDbuPerUU, 1 / myLogicalUnit)
+                for field_it in ['text', 'layer', 'xy']:
+                    self.assertEqual(myTextTable[field_it].tolist(), myExpected[field_it].tolist())
+                self.assertEqual(myTextTable['text'].tolist(), ["TOP_A", "TOP_B"])
+                self.assertIsNone(stic_text.LoadGdstkText(mySettings, myGdsFileName, "NOPE")[1])
+
+DUPLICATED_CHIP_XML = ("<chip><instanceName>XA</instanceName><instanceName>XB</instanceName>"
+    "<cdlFileName>a.cdl</cdlFileName><gdsFileName>a.gds</gdsFileName>"
+    "<layoutName>A</layoutName><layoutName>B</layoutName>"
+    "<orientation>R0</orientation><orientation>R90</orientation>"
+    "<offset><x>1</x><y>2</y></offset><offset><x>3</x><y>4</y></offset>"
+    "<shrink>1.0</shrink><shrink>0.5</shrink></chip>")
+
+class ChipSettingsTest(unittest.TestCase):
+
+    def test_first_duplicate_element_is_used(self):
+        mySettings = stic_text.GetChipSettings(ET.fromstring(DUPLICATED_CHIP_XML))
+        self.assertEqual((mySettings['instanceName'], mySettings['layoutName'],
+                          mySettings['orientation'], mySettings['offset'], mySettings['shrink']),
+                         ("XA", "A", "R0", (1.0, 2.0), 1.0))
+
+if __name__ == '__main__':
+    unittest.main()